@@ -0,0 +1,94 @@
+"""
+Hörprobe eines Songs: die Pulsfolge des Interrupters als WAV.
+
+Gefeuerte Noten, Sperrzeit und t_ON kommen aus songs.note_timeline(), also
+aus demselben Modell wie die Vorab-Analyse. Frequenz und Duty werden wie in
+play_midi_file() berechnet (ganzzahlige PWM-Frequenz, Duty in ppm, inkl.
+Transponierung). Jeder Puls wird als Rechteck exakt über das Abtastintervall
+integriert (Box-Filter), so bleiben auch Pulse kürzer als ein Sample hörbar
+und es entsteht kaum Aliasing.
+
+Erzeugt wird blockweise (CHUNK_SAMPLES), der Speicherbedarf hängt nur von
+der Blockgröße und der Zahl der Noten ab, nicht von der Songlänge.
+"""
+import struct
+
+import numpy as np
+
+import songs
+
+SAMPLE_RATE = 44100
+CHUNK_SAMPLES = 32768
+TAIL_MS = 250  # Stille nach dem Song-Ende
+AMPLITUDE = 0.8
+
+
+def pulse_segments(events, t_on_us, block_time_us, transpose=0):
+    """
+    Liefert pro gefeuerter Note (Start s, Ende s, PWM-Frequenz Hz, Pulsbreite s)
+    sowie die Songlänge in Sekunden. t_on_us ist ein Skalar oder ein Wert pro Event.
+    """
+    tl = songs.note_timeline(events, t_on_us, block_time_us, transpose)
+    freq_int = songs.note_freq(tl['note'], transpose).astype(np.int64)
+    valid = freq_int > 0
+    width = np.where(valid, tl['duty'] / 1_000_000 / np.maximum(freq_int, 1), 0.0)
+    return (tl['start_ms'] / 1000.0, tl['end_ms'] / 1000.0, freq_int.astype(np.float64), width,
+            tl['total_ms'] / 1000.0)
+
+
+def _on_time(t, start, freq, width):
+    """
+    Summe der Einschaltzeit eines bei start beginnenden Pulszugs bis t (vektorisiert).
+    """
+    phase = (t - start) * freq
+    periods = np.floor(phase)
+    return periods * width + np.minimum((phase - periods) / np.maximum(freq, 1.0), width)
+
+
+def synthesize(voices, sample_rate=SAMPLE_RATE, chunk_samples=CHUNK_SAMPLES, tail_ms=TAIL_MS):
+    """
+    Generator über int16-Blöcke der Pulsfolge (mono). voices ist eine Liste
+    von pulse_segments()-Ergebnissen (eine pro Ausgang), die addiert werden.
+    """
+    duration = max(v[4] for v in voices)
+    total = int((duration + tail_ms / 1000.0) * sample_rate)
+    scale = AMPLITUDE * 32767 * sample_rate / len(voices)
+    for first in range(0, total, chunk_samples):
+        n = min(chunk_samples, total - first)
+        t0 = (first + np.arange(n)) / sample_rate
+        t1 = t0 + 1.0 / sample_rate
+        out = np.zeros(n)
+        for start, end, freq, width, _ in voices:
+            if not len(start):
+                continue  # Stimme ohne gespielte Note (z.B. zweiter Ausgang bei einstimmigem Song)
+            seg = np.searchsorted(start, t0, side='right') - 1
+            active = (seg >= 0) & (t0 < end[np.maximum(seg, 0)])
+            if active.any():
+                s = seg[active]
+                a = t0[active]
+                b = np.minimum(t1[active], end[s])
+                on = _on_time(b, start[s], freq[s], width[s]) - _on_time(a, start[s], freq[s], width[s])
+                # Gleichanteil (mittlerer Duty der Note) abziehen, sonst knackt jeder Notenwechsel
+                out[active] += on - (b - a) * width[s] * freq[s]
+        yield np.clip(out * scale, -32768, 32767).astype('<i2').tobytes()
+
+
+def wav_header(num_samples, sample_rate=SAMPLE_RATE):
+    """
+    RIFF/WAVE-Header für 16 Bit PCM mono.
+    """
+    data_size = num_samples * 2
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, 1, 1,
+                       sample_rate, sample_rate * 2, 2, 16, b'data', data_size)
+
+
+def render_wav(voices, transpose=0, sample_rate=SAMPLE_RATE):
+    """
+    Generator über die Bytes einer WAV-Datei (Header, dann Datenblöcke).
+    voices: Liste von (Events, t_ON, Sperrzeit in µs), eine pro Ausgang.
+    """
+    segments = [pulse_segments(events, t_on_us, block_time_us, transpose)
+                for events, t_on_us, block_time_us in voices]
+    duration = max(v[4] for v in segments)
+    yield wav_header(int((duration + TAIL_MS / 1000.0) * sample_rate), sample_rate)
+    yield from synthesize(segments, sample_rate)
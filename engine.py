@@ -0,0 +1,383 @@
+"""
+Wiedergabe-Engine in einem eigenen Prozess (PLAYBACK_ENGINE = 'process').
+
+Web- und Engine-Prozess teilen sich einen Steuerblock in
+multiprocessing.shared_memory, beide Seiten lesen und schreiben ohne zu
+blockieren:
+- Befehle (Abspielen, Stopp, Transponieren, max_t_on) laufen über einen
+  Ringpuffer mit genau einem Schreiber (Web) und einem Leser (Engine).
+- Profiling (tracing.py): die Engine zeichnet selbst auf und schreibt ihre
+  Spans beim Stopp in eine Datei, die der Web-Prozess einliest.
+- Der Status (Position, Verspätung, aktive Note, pigpio-Laufzeit) wird von der Engine per
+  Seqlock veröffentlicht; der Leser wiederholt, bis er einen konsistenten
+  Stand erwischt.
+
+Die Engine schaltet ihre Ausgänge ab, wenn der Web-Prozess verschwindet; der
+Web-Prozess überwacht die Engine (Prozess lebt, Heartbeat) und schaltet bei
+einem Absturz selbst ab und startet sie neu.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import struct
+import threading
+import tempfile
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+logger = logging.getLogger("MIDI")
+
+MAGIC = 0x44525343  # 'DRSC'
+VERSION = 2
+
+CMD_PLAY = 1
+CMD_STOP = 2
+CMD_TRANSPOSE = 3
+CMD_MAX_T_ON = 4  # Flags: Ausgang (1 = zweiter Ausgang)
+CMD_TRACE_START = 5  # Argument: Kapazität (0 = Standard)
+CMD_TRACE_STOP = 6  # Song-Feld: Zieldatei für die Spans
+
+FLAG_AUTO_FIT = 1
+FLAG_THIN = 2
+FLAG_SESSION = 4  # Song-Feld ist der Name einer aufgezeichneten Session (session.py)
+
+RT_SCHED_FIFO = 1
+RT_AFFINITY = 2
+RT_MLOCK = 4
+
+RING_SLOTS = 16
+POLL_S = 0.002  # Befehle abfragen / Status veröffentlichen
+HEARTBEAT_TIMEOUT_S = 0.5  # Engine gilt als hängend, wenn der Heartbeat älter ist
+SUPERVISE_S = 0.05
+TRACE_DUMP_TIMEOUT_S = 5.0
+
+# magic, version, cmd_head, cmd_tail, status_seq, heartbeat_ns
+_HEADER = struct.Struct('<IIQQQQ')
+_HEAD_OFFSET = 8
+_TAIL_OFFSET = 16
+_SEQ_OFFSET = 24
+_HEARTBEAT_OFFSET = 32
+# playing, active_note, transpose, max_t_on, position, total, events,
+# lateness_sum_us, lateness_max_us, cpu_s, 7 Buckets, realtime-Flags, pid, Song,
+# pigpio-Laufzeit (Vorlauf, Median, p10, p90, Umlaufzeit in µs, Zeitpunkt der Kalibrierung)
+_STATUS = struct.Struct('<BhhHIIQddd7QBI64s5dQ')
+_LATENCY_KEYS = ('lead_us', 'median_us', 'p10_us', 'p90_us', 'rtt_median_us')
+_STATUS_OFFSET = _HEADER.size
+# Befehl, Argument, Flags, Song
+_SLOT = struct.Struct('<BiI64s')
+_RING_OFFSET = _STATUS_OFFSET + _STATUS.size
+SIZE = _RING_OFFSET + RING_SLOTS * _SLOT.size
+
+
+class ControlBlock:
+    """
+    Zugriff auf den gemeinsamen Steuerblock. Der Web-Prozess legt ihn an
+    (create=True), die Engine hängt sich per Name an.
+    """
+
+    def __init__(self, name=None, create=False):
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=SIZE if create else 0)
+        self.buf = self.shm.buf
+        self._send_lock = threading.Lock()  # nur zwischen Threads des Web-Prozesses
+        if create:
+            self.buf[:SIZE] = bytes(SIZE)
+            _HEADER.pack_into(self.buf, 0, MAGIC, VERSION, 0, 0, 0, 0)
+        else:
+            # Der Web-Prozess räumt den Block auf, nicht der Resource Tracker der Engine
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+            magic, version = struct.unpack_from('<II', self.buf, 0)
+            if (magic, version) != (MAGIC, VERSION):
+                raise RuntimeError("Steuerblock hat falsches Format")
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _get(self, offset):
+        return struct.unpack_from('<Q', self.buf, offset)[0]
+
+    def _set(self, offset, value):
+        struct.pack_into('<Q', self.buf, offset, value)
+
+    # Web-Seite
+    def send(self, cmd, arg=0, flags=0, song=''):
+        """
+        Legt einen Befehl in den Ring. Liefert False, wenn der Ring voll ist.
+        """
+        with self._send_lock:
+            head = self._get(_HEAD_OFFSET)
+            if head - self._get(_TAIL_OFFSET) >= RING_SLOTS:
+                return False
+            _SLOT.pack_into(self.buf, _RING_OFFSET + (head % RING_SLOTS) * _SLOT.size,
+                            cmd, arg, flags, song.encode()[:64])
+            self._set(_HEAD_OFFSET, head + 1)
+        return True
+
+    def discard(self):
+        """
+        Verwirft alle noch nicht abgeholten Befehle (nur bei gestoppter Engine).
+        """
+        with self._send_lock:
+            self._set(_TAIL_OFFSET, self._get(_HEAD_OFFSET))
+
+    def read_status(self, retries=100):
+        """
+        Liest den zuletzt veröffentlichten Status (Seqlock), None wenn die
+        Engine gerade dauerhaft schreibt.
+        """
+        for _ in range(retries):
+            seq = self._get(_SEQ_OFFSET)
+            if seq & 1:
+                continue
+            values = _STATUS.unpack_from(self.buf, _STATUS_OFFSET)
+            if self._get(_SEQ_OFFSET) == seq:
+                break
+        else:
+            return None
+        (playing, active_note, transpose, max_t_on, position, total, events,
+         lateness_sum, lateness_max, cpu_s, *rest) = values
+        buckets, rt_flags, pid, song = rest[:7], rest[7], rest[8], rest[9]
+        latency = dict(zip(_LATENCY_KEYS, rest[10:15]), calibrated_ns=rest[15] or None)
+        return {
+            'playing': bool(playing),
+            'active_note': active_note if active_note >= 0 else None,
+            'transpose': transpose,
+            'max_t_on': max_t_on,
+            'position': position,
+            'total': total,
+            'events': events,
+            'lateness_sum_us': lateness_sum,
+            'lateness_max_us': lateness_max,
+            'cpu_s': cpu_s,
+            'lateness_buckets': list(buckets),
+            'realtime': {'sched_fifo': bool(rt_flags & RT_SCHED_FIFO),
+                         'affinity': bool(rt_flags & RT_AFFINITY),
+                         'mlock': bool(rt_flags & RT_MLOCK)},
+            'pid': pid,
+            'song': song.rstrip(b'\0').decode(errors='replace'),
+            'pigpio_latency': latency,
+        }
+
+    def heartbeat_age_s(self):
+        return (time.perf_counter_ns() - self._get(_HEARTBEAT_OFFSET)) / 1e9
+
+    # Engine-Seite
+    def receive(self):
+        """
+        Liefert alle neuen Befehle als (Befehl, Argument, Flags, Song).
+        """
+        tail = self._get(_TAIL_OFFSET)
+        head = self._get(_HEAD_OFFSET)
+        commands = []
+        while tail < head:
+            cmd, arg, flags, song = _SLOT.unpack_from(self.buf, _RING_OFFSET + (tail % RING_SLOTS) * _SLOT.size)
+            commands.append((cmd, arg, flags, song.rstrip(b'\0').decode(errors='replace')))
+            tail += 1
+        self._set(_TAIL_OFFSET, tail)
+        return commands
+
+    def publish(self, *values):
+        seq = self._get(_SEQ_OFFSET)
+        self._set(_SEQ_OFFSET, seq + 1)
+        _STATUS.pack_into(self.buf, _STATUS_OFFSET, *values)
+        self._set(_SEQ_OFFSET, seq + 2)
+
+    def beat(self):
+        self._set(_HEARTBEAT_OFFSET, time.perf_counter_ns())
+
+    def close(self, unlink=False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _publish(block, main, song):
+    stats = main.playback_stats
+    rt_flags = 0
+    for key, flag in (('sched_fifo', RT_SCHED_FIFO), ('affinity', RT_AFFINITY), ('mlock', RT_MLOCK)):
+        if main.realtime_status.get(key) is True:
+            rt_flags |= flag
+    active = stats['active_note']
+    latency = main.pigpio_latency
+    block.publish(main.is_playing, -1 if active is None else active, main.MIDI_TRANSPOSE,
+                  main.MIDI_MAX_T_ON, stats['position'], stats['total'], stats['events'],
+                  stats['lateness_sum_us'], stats['lateness_max_us'], stats['cpu_s'], *stats['lateness_buckets'],
+                  rt_flags, os.getpid(), song.encode()[:64], *(latency.get(k, 0.0) for k in _LATENCY_KEYS),
+                  latency.get('calibrated_ns', 0))
+
+
+def run(shm_name):
+    """
+    Einstiegspunkt des Engine-Prozesses: eigene Verbindung zum Backend,
+    Wiedergabe in einem Thread, Befehle und Status im Haupt-Thread.
+    """
+    import main
+    import songpack
+    import tracing
+    block = ControlBlock(shm_name)
+    songpack.use(main.SONG_PACK_PATH, main.MIDI_FILES_DIR)
+    main.connect_backend()
+    main._stop_all_outputs()
+    main.start_latency_calibration()
+    parent = os.getppid()
+    player = None
+    song = ''
+    try:
+        while os.getppid() == parent:
+            for cmd, arg, flags, name in block.receive():
+                if cmd == CMD_PLAY and flags & FLAG_SESSION and not main.is_playing:
+                    try:
+                        events = main.load_session(name)
+                    except (OSError, ValueError) as e:
+                        logger.error(f"Engine: Session {name} kann nicht geladen werden: {e}")
+                        continue
+                    song = name
+                    main.is_playing = True
+                    player = threading.Thread(target=main.play_session, args=(name, events), daemon=True)
+                    player.start()
+                elif cmd == CMD_PLAY and not main.is_playing:
+                    filepath = os.path.join(main.MIDI_FILES_DIR, name)
+                    try:
+                        events, t_on_us, outputs, _ = main.prepare_playback(
+                            filepath, auto_fit=flags & FLAG_AUTO_FIT, thin=flags & FLAG_THIN)
+                    except Exception as e:
+                        logger.error(f"Engine: {name} kann nicht geladen werden: {e}")
+                        continue
+                    song = name
+                    main.is_playing = True
+                    player = threading.Thread(target=main.play_midi_file, args=(filepath, events, t_on_us),
+                                              kwargs={'outputs': outputs}, daemon=True)
+                    player.start()
+                elif cmd == CMD_STOP:
+                    main.is_playing = False
+                elif cmd == CMD_TRANSPOSE:
+                    main.MIDI_TRANSPOSE = arg
+                elif cmd == CMD_MAX_T_ON and flags:
+                    main.OUTPUT2_MAX_T_ON = arg
+                elif cmd == CMD_MAX_T_ON:
+                    main.MIDI_MAX_T_ON = arg
+                elif cmd == CMD_TRACE_START:
+                    tracing.TRACER.start(arg or None)
+                elif cmd == CMD_TRACE_STOP:
+                    tracing.TRACER.stop()
+                    try:
+                        tracing.dump_events(tracing.TRACER, name, 'engine')
+                    except OSError as e:
+                        logger.error(f"Engine: Trace kann nicht geschrieben werden: {e}")
+            _publish(block, main, song)
+            block.beat()
+            time.sleep(POLL_S)
+    finally:
+        main.is_playing = False
+        if player is not None:
+            player.join(1.0)
+        main._stop_all_outputs()
+        block.close()
+
+
+class EngineProcess:
+    """
+    Web-Seite: startet und überwacht den Engine-Prozess. on_failure(Grund)
+    wird im Web-Prozess aufgerufen, wenn die Engine abstürzt oder hängt,
+    und muss die Ausgänge sicher abschalten; on_stopped() nach dem Ende
+    einer Wiedergabe.
+    """
+
+    def __init__(self, on_failure, on_stopped=None):
+        self.block = ControlBlock(create=True)
+        self.on_failure = on_failure
+        self.on_stopped = on_stopped
+        self._ctx = multiprocessing.get_context('spawn')
+        self.process = None
+        self._trace_path = os.path.join(tempfile.gettempdir(), f"interrupter-trace-{os.getpid()}.json")
+        self._trace_requested = False
+        self._start()
+        threading.Thread(target=self._supervise, daemon=True).start()
+
+    def _start(self):
+        self.process = self._ctx.Process(target=run, args=(self.block.name,), daemon=True)
+        self.process.start()
+
+    def _supervise(self):
+        was_playing = False
+        while True:
+            time.sleep(SUPERVISE_S)
+            reason = None
+            if not self.process.is_alive():
+                reason = f"Engine-Prozess beendet (Exit-Code {self.process.exitcode})"
+            else:
+                status = self.block.read_status()
+                playing = bool(status and status['playing'])
+                if playing and self.block.heartbeat_age_s() > HEARTBEAT_TIMEOUT_S:
+                    reason = "Engine-Prozess reagiert nicht"
+                elif was_playing and not playing and self.on_stopped is not None:
+                    self.on_stopped()
+                was_playing = playing
+            if reason is None:
+                continue
+            was_playing = False
+            self.on_failure(reason)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+            reset = list(_STATUS.unpack(bytes(_STATUS.size)))
+            reset[1] = -1  # keine aktive Note
+            self.block.publish(*reset)
+            # Befehle an die alte Engine nicht von der neuen ausführen lassen
+            self.block.discard()
+            self._start()
+
+    def play(self, song, auto_fit=False, thin=False, session=False):
+        flags = (FLAG_AUTO_FIT if auto_fit else 0) | (FLAG_THIN if thin else 0) | (FLAG_SESSION if session else 0)
+        return self.block.send(CMD_PLAY, flags=flags, song=song)
+
+    def stop(self):
+        return self.block.send(CMD_STOP)
+
+    def set_transpose(self, semitones):
+        return self.block.send(CMD_TRANSPOSE, semitones)
+
+    def set_max_t_on(self, t_on_us, output=1):
+        return self.block.send(CMD_MAX_T_ON, t_on_us, flags=output - 1)
+
+    def status(self):
+        return self.block.read_status()
+
+    def alive(self):
+        """
+        Engine-Prozess läuft, hat sich mit eigenem Status gemeldet und sein
+        Heartbeat ist frisch (nimmt also Befehle an).
+        """
+        if not self.process.is_alive() or self.block.heartbeat_age_s() > HEARTBEAT_TIMEOUT_S:
+            return False
+        status = self.block.read_status()
+        return status is not None and status['pid'] == self.process.pid
+
+    def trace_start(self, capacity=None):
+        return self.block.send(CMD_TRACE_START, capacity or 0)
+
+    def trace_stop(self):
+        try:
+            os.unlink(self._trace_path)
+        except FileNotFoundError:
+            pass
+        self._trace_requested = True
+        return self.block.send(CMD_TRACE_STOP, song=self._trace_path)
+
+    def trace_events(self, timeout=TRACE_DUMP_TIMEOUT_S):
+        """
+        Spans der letzten Engine-Aufzeichnung; wartet nach trace_stop() höchstens
+        timeout Sekunden auf die Datei. Leere Liste, wenn keine vorliegt.
+        """
+        if not self._trace_requested:
+            return []
+        deadline = time.monotonic() + timeout
+        while not os.path.exists(self._trace_path):
+            if time.monotonic() > deadline:
+                logger.warning("Engine hat keinen Trace geschrieben")
+                return []
+            time.sleep(POLL_S)
+        with open(self._trace_path) as f:
+            return json.load(f)
@@ -0,0 +1,217 @@
+"""
+Flottenbetrieb: mehrere Controller (je ein Pi mit diesem Server) spielen
+einen Song synchron, jeder Knoten eine Stimme (songs.split_voices()).
+
+- Uhrabgleich NTP-artig über UDP: Der Follower schickt t0, der Leader
+  antwortet mit Empfangs- und Sendezeit t1/t2, der Follower notiert t3.
+  Offset = ((t1 - t0) + (t2 - t3)) / 2, Laufzeit = (t3 - t0) - (t2 - t1).
+  Pro Runde zählt die Messung mit der kürzesten Laufzeit; die Runde wird
+  alle SYNC_INTERVAL_S wiederholt. Nebenbei meldet sich der Follower damit
+  beim Leader an und bekommt seine Stimme zugeteilt.
+- Start: Der Leader teilt den Song auf, schickt jedem Follower per HTTP
+  (POST /fleet/start) dessen Stimme und einen Startzeitpunkt in Leader-Zeit
+  (FLEET_LEAD_MS in der Zukunft) und spielt selbst Stimme 0. Jeder Knoten
+  rechnet den Zeitpunkt in seine Uhr um und übergibt ihn an play_midi_file().
+
+Die Zeitbasis ist time.perf_counter_ns(). sim_offset_ns verschiebt die Uhr
+eines Knotens künstlich, damit sich der Abgleich auch mit mehreren lokalen
+Prozessen (die sonst dieselbe Uhr haben) testen lässt (tools/fleet_demo.py).
+"""
+import concurrent.futures
+import logging
+import socket
+import struct
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+logger = logging.getLogger("MIDI")
+
+MAGIC = b'DRSF'
+PORT = 5005
+MSG_SYNC = 1
+MSG_REPLY = 2
+
+SYNC_INTERVAL_S = 2.0
+SYNC_SAMPLES = 8
+SYNC_TIMEOUT_S = 0.2
+MAX_SYNC_AGE_S = 10.0  # älterer Abgleich gilt nicht mehr, Start wird abgelehnt
+FOLLOWER_TIMEOUT_S = 3 * SYNC_INTERVAL_S  # Follower ohne Abgleich gilt als weg
+
+# magic, Typ, Sequenz, t0, HTTP-Port des Followers, gewünschte Stimme (-1 = automatisch)
+_SYNC = struct.Struct('<4sBIqHh')
+# magic, Typ, Sequenz, t0, t1, t2, zugeteilte Stimme
+_REPLY = struct.Struct('<4sBIqqqh')
+
+
+class Leader:
+    """
+    Beantwortet Abgleich-Anfragen und führt die Liste der Follower.
+    """
+
+    def __init__(self, port=PORT, sim_offset_ns=0):
+        self.port = port
+        self.sim_offset_ns = sim_offset_ns
+        self.followers = {}  # (IP, HTTP-Port) -> {'voice', 'last_seen'}
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('0.0.0.0', port))
+        threading.Thread(target=self._serve, name='fleet-leader', daemon=True).start()
+
+    def now(self):
+        return time.perf_counter_ns() + self.sim_offset_ns
+
+    def to_local(self, leader_ns):
+        """
+        Leader-Zeit -> perf_counter_ns() dieses Prozesses.
+        """
+        return leader_ns - self.sim_offset_ns
+
+    def _assign(self, key, wanted, now):
+        entry = self.followers.get(key)
+        if entry is None:
+            taken = {f['voice'] for k, f in self._active(now)}
+            voice = wanted if wanted >= 0 else next(v for v in range(1, len(taken) + 2) if v not in taken)
+            entry = self.followers[key] = {'voice': voice, 'last_seen': now}
+            logger.info(f"Flotte: Follower {key[0]}:{key[1]} übernimmt Stimme {voice}")
+        entry['last_seen'] = now
+        return entry['voice']
+
+    def _serve(self):
+        while True:
+            data, addr = self._sock.recvfrom(64)
+            t1 = self.now()
+            if len(data) != _SYNC.size:
+                continue
+            magic, msg, seq, t0, http_port, wanted = _SYNC.unpack(data)
+            if magic != MAGIC or msg != MSG_SYNC:
+                continue
+            with self._lock:
+                voice = self._assign((addr[0], http_port), wanted, time.monotonic())
+            self._sock.sendto(_REPLY.pack(MAGIC, MSG_REPLY, seq, t0, t1, self.now(), voice), addr)
+
+    def active_followers(self, now=None):
+        """
+        [((IP, HTTP-Port), Eintrag), ...] aller Follower mit frischem Abgleich, nach Stimme sortiert.
+        """
+        with self._lock:
+            return self._active(time.monotonic() if now is None else now)
+
+    def _active(self, now):
+        # Nur mit self._lock aufrufen, _serve() trägt neue Follower ein
+        active = [(k, dict(f)) for k, f in self.followers.items() if now - f['last_seen'] < FOLLOWER_TIMEOUT_S]
+        return sorted(active, key=lambda item: item[1]['voice'])
+
+    def status(self):
+        with self._lock:
+            followers = [{'address': f"{ip}:{port}", 'voice': f['voice'],
+                          'last_seen_s': round(time.monotonic() - f['last_seen'], 3)}
+                         for (ip, port), f in self._active(time.monotonic())]
+        return {'role': 'leader', 'port': self.port, 'voice': 0, 'followers': followers}
+
+
+def send_start(followers, parts, start_ns, song, auto_fit=False, thin=False, timeout=2.0):
+    """
+    Schickt jedem Follower seine Stimme (Event-Bytes) und den Startzeitpunkt
+    in Leader-Zeit, parallel. Liefert pro Follower ein dict mit Ergebnis.
+    """
+    def post(item):
+        (ip, port), entry = item
+        voice = entry['voice']
+        query = urllib.parse.urlencode({'start_ns': start_ns, 'song': song, 'voice': voice,
+                                        'auto_fit': int(bool(auto_fit)), 'thin': int(bool(thin))})
+        req = urllib.request.Request(f"http://{ip}:{port}/fleet/start?{query}", data=parts[voice].tobytes(),
+                                     headers={'Content-Type': 'application/octet-stream'})
+        result = {'address': f"{ip}:{port}", 'voice': voice}
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                resp.read()
+            result['status'] = 'success'
+        except OSError as e:
+            result.update(status='error', message=str(e))
+        return result
+
+    if not followers:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(len(followers)) as pool:
+        return list(pool.map(post, followers))
+
+
+class Follower:
+    """
+    Gleicht die eigene Uhr regelmäßig mit dem Leader ab.
+    offset_ns ist Leader-Uhr minus eigene Uhr (inkl. sim_offset_ns).
+    """
+
+    def __init__(self, leader_host, http_port, leader_port=PORT, voice=-1, sim_offset_ns=0):
+        self.leader = (leader_host, leader_port)
+        self.http_port = http_port
+        self.wanted_voice = voice
+        self.sim_offset_ns = sim_offset_ns
+        self.voice = None
+        self.offset_ns = None
+        self.delay_ns = None
+        self.synced_at = None
+        self._seq = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.settimeout(SYNC_TIMEOUT_S)
+        threading.Thread(target=self._run, name='fleet-sync', daemon=True).start()
+
+    def now(self):
+        return time.perf_counter_ns() + self.sim_offset_ns
+
+    def to_local(self, leader_ns):
+        """
+        Leader-Zeit -> perf_counter_ns() dieses Prozesses.
+        """
+        return leader_ns - self.offset_ns - self.sim_offset_ns
+
+    def synced(self):
+        return self.synced_at is not None and time.monotonic() - self.synced_at < MAX_SYNC_AGE_S
+
+    def _exchange(self):
+        self._seq += 1
+        t0 = self.now()
+        self._sock.sendto(_SYNC.pack(MAGIC, MSG_SYNC, self._seq, t0, self.http_port, self.wanted_voice), self.leader)
+        while True:
+            data = self._sock.recv(64)
+            t3 = self.now()
+            if len(data) != _REPLY.size:
+                continue
+            magic, msg, seq, r_t0, t1, t2, voice = _REPLY.unpack(data)
+            if magic == MAGIC and msg == MSG_REPLY and seq == self._seq and r_t0 == t0:
+                return ((t1 - t0) + (t2 - t3)) // 2, (t3 - t0) - (t2 - t1), voice
+
+    def sync_once(self):
+        """
+        Eine Abgleich-Runde; übernimmt die Messung mit der kürzesten Laufzeit.
+        """
+        best = None
+        for _ in range(SYNC_SAMPLES):
+            try:
+                sample = self._exchange()
+            except OSError:
+                continue
+            if best is None or sample[1] < best[1]:
+                best = sample
+        if best is None:
+            return False
+        self.offset_ns, self.delay_ns, self.voice = best
+        self.synced_at = time.monotonic()
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                if not self.sync_once():
+                    logger.warning(f"Flotte: Leader {self.leader[0]}:{self.leader[1]} antwortet nicht")
+            except OSError as e:
+                logger.warning(f"Flotte: Abgleich fehlgeschlagen: {e}")
+            time.sleep(SYNC_INTERVAL_S)
+
+    def status(self):
+        return {'role': 'follower', 'leader': f"{self.leader[0]}:{self.leader[1]}", 'voice': self.voice,
+                'synced': self.synced(), 'offset_ns': self.offset_ns, 'delay_ns': self.delay_ns,
+                'sync_age_s': round(time.monotonic() - self.synced_at, 3) if self.synced_at else None}
@@ -0,0 +1,43 @@
+"""
+Kalibrierung der pigpio-Befehlslaufzeit.
+
+Jeder Befehl geht über den pigpiod-Socket und wird erst im Daemon
+ausgeführt; bis dahin vergehen je nach Last einige zehn bis hundert µs.
+Gemessen wird wie beim Uhrabgleich der Flotte (fleet.py): vor und nach
+get_current_tick() wird die eigene Uhr gelesen, der Tick ist die Daemon-Zeit
+der Ausführung. Aus der Messung mit der kürzesten Laufzeit ergibt sich der
+Uhrversatz (Hin- und Rückweg gleich lang angenommen), damit für jede Messung
+die Zeit vom Absenden bis zur Ausführung. Deren Median ist der Vorlauf, um
+den play_midi_file() jedes Event früher ausgibt.
+"""
+import time
+
+SAMPLES = 200
+TICK_WRAP = 1 << 32  # pigpio-Ticks sind µs als 32 Bit, laufen nach gut 71 Minuten über
+
+
+def _percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def measure(pi, samples=SAMPLES):
+    """
+    Misst die Laufzeit bis zur Ausführung im Daemon. Liefert Median, 10. und
+    90. Perzentil sowie den Median der Umlaufzeit in µs und die Zahl der Messungen.
+    """
+    clock = time.perf_counter_ns
+    raw = []
+    for _ in range(samples):
+        t0 = clock()
+        tick = pi.get_current_tick()
+        t3 = clock()
+        raw.append((t0, tick, t3))
+    base = raw[0][1]
+    ticks_ns = [((tick - base) % TICK_WRAP) * 1000 for _, tick, _ in raw]
+    best = min(range(samples), key=lambda i: raw[i][2] - raw[i][0])
+    offset = ticks_ns[best] - (raw[best][0] + raw[best][2]) // 2
+    one_way = sorted((tick_ns - offset - t0) / 1000 for tick_ns, (t0, _, _) in zip(ticks_ns, raw))
+    rtt = sorted((t3 - t0) / 1000 for t0, _, t3 in raw)
+    return {'median_us': round(_percentile(one_way, 50), 1), 'p10_us': round(_percentile(one_way, 10), 1),
+            'p90_us': round(_percentile(one_way, 90), 1), 'rtt_median_us': round(_percentile(rtt, 50), 1),
+            'samples': samples}
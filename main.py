@@ -1,26 +1,79 @@
+import gc
+import itertools
 import time
 import subprocess
 import math
 import struct
 import os
+import re
 import logging
 import threading
-from matplotlib.transforms import offset_copy
-import pigpio
-from flask import Flask, request, jsonify, render_template
+from flask import Blueprint, Flask, Response, request, jsonify, render_template, send_file
+import metrics
+import session
+import songpack
+import tracing
 
-app = Flask(__name__)
+# Routen werden in create_app() an die Flask-App gehängt
+bp = Blueprint('interrupter', __name__)
 
 # Begrenzungen
 MAX_T_ON = 200 # 125 us
 MIN_T_OFF = 5  # 1 ms
 MAX_DUTY_CYCLE = 1 # 10%
 MIDI_MAX_T_ON = 100  # Standard auf 200 µs, kann über API angepasst werden
+MIDI_TRANSPOSE = 0  # Transponierung in Halbtönen, kann über API angepasst werden
 MIDI_NOTE_RATE_LIMIT = 50  # Minimum Zeit zwischen zwei Noten in ms
 NOTE_BLOCK_TIME_US = 1000  # Sperrzeit nach jedem Pulse in Mikrosekunden
-
-# Verbindung zum pigpio-Daemon
-pi = pigpio.pi()
+OPTIMIZE_EVENTS = True  # Überflüssige Hardware-Updates beim Laden entfernen (songs.optimize_events)
+
+# Echtzeit-Wiedergabe: SCHED_FIFO, CPU-Pinning, mlockall und GC aus während eines Songs
+REALTIME_PLAYBACK = os.environ.get('INTERRUPTER_REALTIME') == '1'
+REALTIME_PRIORITY = 80  # SCHED_FIFO-Priorität (1-99)
+REALTIME_CPU = max(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else 0  # Idealerweise per isolcpus freigehaltene CPU
+REALTIME_SPIN_US = 2000  # Im Echtzeit-Modus nur die letzten µs vor einem Event aktiv warten
+realtime_status = {}  # Ergebnis der Echtzeit-Einstellungen (Start-Probe bzw. letzte Wiedergabe)
+
+# pigpio-Laufzeit (latency.py): Events um den Median früher ausgeben, damit sie pünktlich am Pin ankommen
+LATENCY_COMPENSATION = os.environ.get('INTERRUPTER_LATENCY_COMP', '1') == '1'
+LATENCY_CALIBRATION_INTERVAL_S = 60  # Nachkalibrieren, nur wenn gerade kein Song läuft
+LATENCY_MAX_LEAD_US = 1000  # Obergrenze für den Vorlauf, schützt vor Ausreißern
+pigpio_latency = {'lead_us': 0.0}  # Letzte Kalibrierung (latency.measure()), lead_us = aktueller Vorlauf
+
+# Verspätung der Events gegenüber ihrem Soll-Zeitpunkt, Grenzen der Histogramm-Buckets in µs
+LATENESS_BUCKETS_US = (10, 50, 100, 500, 1000, 5000)
+playback_stats = {'events': 0, 'lateness_sum_us': 0.0, 'lateness_max_us': 0.0,
+                  'lateness_buckets': [0] * (len(LATENESS_BUCKETS_US) + 1),
+                  'position': 0, 'total': 0, 'active_note': None,
+                  'start_ns': 0, 'first_note_late_us': None,  # Songbeginn (perf_counter_ns), Verspätung 1. Note
+                  'last_note_late_us': None,  # Verspätung der zuletzt gespielten Note
+                  'cpu_s': 0.0}  # CPU-Zeit aller Wiedergabe-Threads seit Prozessstart
+
+# Wiedergabe im Web-Prozess ('thread') oder in einem eigenen Prozess ('process', siehe engine.py)
+PLAYBACK_ENGINE = os.environ.get('INTERRUPTER_ENGINE', 'thread')
+engine_process = None
+preview_renderer = None  # render.PreviewRenderer, beim ersten Vorschaubild angelegt
+
+HTTP_PORT = int(os.environ.get('INTERRUPTER_PORT', 5000))
+
+# Flottenbetrieb (fleet.py): '' = aus, 'leader' oder 'follower' (nur mit PLAYBACK_ENGINE = 'thread')
+FLEET_ROLE = os.environ.get('INTERRUPTER_FLEET', '')
+FLEET_LEADER = os.environ.get('INTERRUPTER_FLEET_LEADER', '')  # host[:port] des Leaders (Follower)
+FLEET_PORT = int(os.environ.get('INTERRUPTER_FLEET_PORT', 5005))  # UDP-Port für den Uhrabgleich (Leader)
+FLEET_VOICE = int(os.environ.get('INTERRUPTER_FLEET_VOICE', -1))  # Stimme des Followers, -1 = automatisch
+FLEET_LEAD_MS = 500  # Vorlauf zwischen Startbefehl und Songbeginn
+# Künstlicher Uhrversatz, nur um den Abgleich mit lokalen Prozessen zu testen
+FLEET_SIM_OFFSET_NS = int(float(os.environ.get('INTERRUPTER_FLEET_SIM_OFFSET_MS', 0)) * 1_000_000)
+fleet_node = None  # fleet.Leader oder fleet.Follower
+
+# Hardware-Backend: 'pigpio' (echter Pi) oder 'sim' (sim_pigpio, ohne Hardware)
+HARDWARE_BACKEND = os.environ.get('INTERRUPTER_BACKEND', 'pigpio')
+HARDWARE_WAIT_S = 5  # So lange warten Hardware-Routen beim Start auf init_hardware()
+
+# Verbindung zum pigpio-Daemon, wird in init_hardware() im Hintergrund aufgebaut
+pigpio = None
+pi = None
+hardware_ready = threading.Event()
 
 # Festlegung der GPIO-Pins
 
@@ -30,6 +83,13 @@ SOFTSTART_PIN = 20  # GPIO für den 56-Ohm-Widerstand (Softstart)
 FULLPOWER_PIN = 21  # GPIO für den Bypass des Widerstands (Vollbetrieb)
 INTERRUPTER_PIN = 12 # GPIO-Pin für das Interrupter-Signal
 SPEAKER_PIN = 13 # GPIO-Pin für akustische Signale
+# Zweiter Interrupter-Ausgang (PWM1): Songs werden auf zwei Stimmen verteilt,
+# eine pro Ausgang. Belegt den Pin des Piepers, der dann stumm bleibt.
+DUAL_OUTPUT = os.environ.get('INTERRUPTER_DUAL_OUTPUT') == '1'
+INTERRUPTER2_PIN = 13
+OUTPUT2_MAX_T_ON = 100  # Eigene Grenzen für Ausgang 2 (max. t_ON in µs, Duty-Budget in %, Sperrzeit)
+OUTPUT2_MAX_DUTY_CYCLE = 1
+OUTPUT2_BLOCK_TIME_US = 1000
 # Globale Variable für Softstart-Fortschritt
 connection_ok = False  # Verbindung zu deinem Handy
 softstart_progress = 0
@@ -41,29 +101,132 @@ cw_running = False
 cw_lock = threading.Lock()
 power_lock = threading.Lock()
 
+# Kennzahlen für /metrics, alle Label-Werte werden beim Start angelegt (metrics.py)
+METRICS_ENABLED = os.environ.get('INTERRUPTER_METRICS', '1') == '1'
+INTERRUPTER_MODES = ('off', 'cw', 'burst', 'ton_toff', 'duty_cycle', 'midi', 'session')
+METRICS = metrics.Registry()
+HTTP_REQUESTS = METRICS.register(metrics.Family(
+    'interrupter_http_requests_total', 'Anfragen pro Route', 'counter', ('route',)))
+HTTP_LATENCY = METRICS.register(metrics.Family(
+    'interrupter_http_request_duration_seconds', 'Bearbeitungszeit pro Route', 'histogram', ('route',),
+    metric_factory=lambda: metrics.Histogram(metrics.LATENCY_BUCKETS_S)))
+PIGPIO_LATENCY = METRICS.register(metrics.Family(
+    'interrupter_pigpio_call_duration_seconds', 'Dauer der pigpio-Befehle', 'histogram', ('command',),
+    metrics.InstrumentedPi.COMMANDS, metric_factory=lambda: metrics.Histogram(metrics.PIGPIO_BUCKETS_S)))
+WATCHDOG_RTT = METRICS.register(metrics.Family(
+    'interrupter_watchdog_rtt_seconds', 'Ping-Laufzeit des Watchdogs', 'histogram',
+    metric_factory=lambda: metrics.Histogram(metrics.LATENCY_BUCKETS_S))).labels()
+WATCHDOG_FAILURES = METRICS.register(metrics.Family(
+    'interrupter_watchdog_failures_total', 'Fehlgeschlagene Pings des Watchdogs', 'counter')).labels()
+SINGLE_SHOTS = METRICS.register(metrics.Family(
+    'interrupter_single_shots_total', 'Gefeuerte Single Shots', 'counter')).labels()
+MODE_TIMER = metrics.StateTimer(INTERRUPTER_MODES, 'off')
+METRICS.register(metrics.StateFamily(
+    'interrupter_mode_seconds_total', 'Zeit pro Interrupter-Modus', None, {None: MODE_TIMER}, state_label='mode'))
+TRACE_REQUEST_SAMPLE = 4  # Bei laufender Aufzeichnung jede n-te Flask-Anfrage als Span erfassen
+TRACE_EVENT_NAMES = {0x90: 'NOTE_ON', 0x80: 'NOTE_OFF'}
+RELAY_TIMERS = {'softstart': metrics.StateTimer(('on', 'off'), 'off'),
+                'fullpower': metrics.StateTimer(('on', 'off'), 'off')}
+METRICS.register(metrics.StateFamily(
+    'interrupter_relay_state_seconds_total', 'Zeit pro Relaiszustand', 'relay', RELAY_TIMERS))
+
 def play_beep(pin, freq=1000, duration_ms=200):
     """
     Gibt einen kurzen Piepton auf dem angegebenen Pin aus.
     """
+    if DUAL_OUTPUT and pin == INTERRUPTER2_PIN:
+        return  # Pin gehört dem zweiten Interrupter-Ausgang
     pi.set_PWM_frequency(pin, freq)
     pi.set_PWM_dutycycle(pin, 128)  # 50% Duty Cycle
     time.sleep(duration_ms / 1000)
     pi.set_PWM_dutycycle(pin, 0)
 
+def connect_backend():
+    """
+    Baut die Verbindung zum Backend auf (pigpio-Daemon oder Simulation).
+    """
+    global pigpio, pi
+    if HARDWARE_BACKEND == 'sim':
+        import sim_pigpio as backend
+    else:
+        import pigpio as backend
+    pigpio = backend
+    pi = pigpio.pi()
+    if METRICS_ENABLED:
+        # Relais sind active low: 0 = an
+        pi = metrics.InstrumentedPi(pi, PIGPIO_LATENCY, tracer=tracing.TRACER, write_hooks={
+            SOFTSTART_PIN: lambda level: RELAY_TIMERS['softstart'].set('on' if level == 0 else 'off'),
+            FULLPOWER_PIN: lambda level: RELAY_TIMERS['fullpower'].set('on' if level == 0 else 'off'),
+        })
+
+
+def init_hardware():
+    """
+    Verbindet mit dem Backend, initialisiert die GPIO-Pins und startet den Watchdog.
+    Läuft in einem Hintergrund-Thread, der Server nimmt währenddessen schon Anfragen an.
+    """
+    connect_backend()
+
+    # GPIO-Pins initialisieren
+    pi.set_mode(READY_LED_PIN, pigpio.OUTPUT)
+    pi.set_mode(SOFTSTART_PIN, pigpio.OUTPUT)
+    pi.set_mode(FULLPOWER_PIN, pigpio.OUTPUT)
+    pi.set_mode(INTERRUPTER_PIN, pigpio.OUTPUT)  # Interrupter-Signal als Ausgang
+    pi.set_mode(SPEAKER_PIN, pigpio.OUTPUT)
+    pi.write(SOFTSTART_PIN, 1)
+    pi.write(FULLPOWER_PIN, 1)
+    pi.write(INTERRUPTER_PIN, 0)  # Interrupter-Signal auf LOW setzen
+    if DUAL_OUTPUT:
+        pi.write(INTERRUPTER2_PIN, 0)
+    pi.write(READY_LED_PIN, 1) # System ready.LED an
+    if PLAYBACK_ENGINE == 'thread':
+        start_latency_calibration()
+    hardware_ready.set()
+
+    if REALTIME_PLAYBACK and PLAYBACK_ENGINE == 'thread':
+        import realtime
+        realtime_status.update(realtime.probe(REALTIME_PRIORITY, REALTIME_CPU))
+        logger.info(f"Echtzeit-Wiedergabe (CPU {REALTIME_CPU}, Priorität {REALTIME_PRIORITY}): "
+                    + ", ".join(f"{k}={'OK' if v is True else v}" for k, v in realtime_status.items()))
+
+    # Starte den Watchdog beim Boot
+    threading.Thread(target=watchdog, daemon=True).start()
+
+    # Akustische Bestätigung
+    play_beep(SPEAKER_PIN, freq=444, duration_ms=200)
+    pi.write(SPEAKER_PIN, 0)
+
+def calibrate_latency():
+    """
+    Misst die pigpio-Laufzeit und übernimmt den Median als Vorlauf für die Wiedergabe.
+    """
+    import latency
+    result = latency.measure(pi)
+    lead_us = min(max(result['median_us'], 0.0), LATENCY_MAX_LEAD_US) if LATENCY_COMPENSATION else 0.0
+    pigpio_latency.update(result, lead_us=lead_us, calibrated_ns=time.perf_counter_ns())
+    logger.info(f"pigpio-Laufzeit: Median {result['median_us']} µs (p10 {result['p10_us']}, "
+                f"p90 {result['p90_us']}), Vorlauf {lead_us} µs")
+
+
+def _latency_calibrator():
+    while True:
+        time.sleep(LATENCY_CALIBRATION_INTERVAL_S)
+        # Während eines Songs würden die Messbefehle die Wiedergabe stören
+        if not is_playing:
+            try:
+                calibrate_latency()
+            except Exception as e:
+                logger.warning(f"pigpio-Laufzeit kann nicht gemessen werden: {e}")
+
+
+def start_latency_calibration():
+    """
+    Erste Kalibrierung sofort, danach alle LATENCY_CALIBRATION_INTERVAL_S.
+    Läuft in dem Prozess, der die Wiedergabe macht.
+    """
+    calibrate_latency()
+    threading.Thread(target=_latency_calibrator, name='latency-calibration', daemon=True).start()
 
-# GPIO-Pins initialisieren
-pi.set_mode(READY_LED_PIN, pigpio.OUTPUT)
-pi.set_mode(SOFTSTART_PIN, pigpio.OUTPUT)
-pi.set_mode(FULLPOWER_PIN, pigpio.OUTPUT)
-pi.set_mode(INTERRUPTER_PIN, pigpio.OUTPUT)  # Interrupter-Signal als Ausgang
-pi.set_mode(SPEAKER_PIN, pigpio.OUTPUT)
-pi.write(READY_LED_PIN, 1) # System ready.LED an
-# Akustische Bestätigung
-play_beep(SPEAKER_PIN, freq=444, duration_ms=200)
-pi.write(SOFTSTART_PIN, 1)
-pi.write(FULLPOWER_PIN, 1)
-pi.write(INTERRUPTER_PIN, 0)  # Interrupter-Signal auf LOW setzen
-pi.write(SPEAKER_PIN, 0)
 
 # Logging konfigurieren
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(message)s')
@@ -71,6 +234,8 @@ logger = logging.getLogger("MIDI")
 
 # MIDI-Pfad definition
 MIDI_FILES_DIR = './data/midi-files/'
+# Gesamte Bibliothek als eine Datei (tools/build_song_pack.py), falls vorhanden
+SONG_PACK_PATH = os.environ.get('INTERRUPTER_SONG_PACK', './data/songs.pack')
 current_midi_data = []
 
 def _stop_all_outputs():
@@ -95,6 +260,10 @@ def _stop_all_outputs():
         pass
     # Pin Low
     pi.write(INTERRUPTER_PIN, 0)
+    if DUAL_OUTPUT:
+        pi.hardware_PWM(INTERRUPTER2_PIN, 0, 0)
+        pi.write(INTERRUPTER2_PIN, 0)
+    MODE_TIMER.set('off')
 
 def safe_power_off(reason=None):
     """
@@ -113,28 +282,31 @@ def get_power_state():
     fullpower_on = pi.read(FULLPOWER_PIN) == 0
     return softstart_on or fullpower_on
 
-@app.route('/start_cw', methods=['POST'])
+@bp.route('/start_cw', methods=['POST'])
 def start_cw():
     """
     Minimaler CW-Start: alle anderen Outputs stoppen, Interrupter-Pin dauerhaft HIGH.
     """
-    global cw_running, is_playing, burst_active
+    global cw_running, burst_active
     with cw_lock:
         if cw_running:
             # idempotent – Frontend bekommt 'läuft schon'
             return jsonify({'status': 'success', 'message': 'CW läuft bereits'})
         # Andere Modi sauber beenden
-        is_playing = False
+        _stop_playback()
         burst_active = False
         _stop_all_outputs()
 
         # Dauerhaftes Enable: Interrupter auf HIGH
         pi.write(INTERRUPTER_PIN, 1)
+        session.RECORDER.record(session.OFF, INTERRUPTER_PIN)
+        session.RECORDER.record(session.LEVEL, INTERRUPTER_PIN, 1)
+        MODE_TIMER.set('cw')
         cw_running = True
     return jsonify({'status': 'success', 'message': 'CW gestartet'})
 
 
-@app.route('/stop_cw', methods=['POST'])
+@bp.route('/stop_cw', methods=['POST'])
 def stop_cw():
     """
     CW stoppen: Outputs killen & Pin LOW.
@@ -143,22 +315,32 @@ def stop_cw():
     with cw_lock:
         if not cw_running:
             _stop_all_outputs()  # idempotent
+            session.RECORDER.record(session.OFF, INTERRUPTER_PIN)
             return jsonify({'status': 'success', 'message': 'CW war nicht aktiv'})
         cw_running = False
         _stop_all_outputs()
+        session.RECORDER.record(session.OFF, INTERRUPTER_PIN)
     return jsonify({'status': 'success', 'message': 'CW gestoppt'})
 
     
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template('index.html')
     pi.write(INTERRUPTER_PIN, 0)
 
 def ping_device(ip):
     try:
+        start = time.perf_counter()
         output = subprocess.run(['ping', '-c', '1', '-W', '1', ip], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return output.returncode == 0
+        if output.returncode != 0:
+            WATCHDOG_FAILURES.inc()
+            return False
+        # RTT aus der ping-Ausgabe, sonst die Laufzeit des ping-Prozesses
+        match = re.search(rb'time=([\d.]+) ms', output.stdout)
+        WATCHDOG_RTT.observe(float(match.group(1)) / 1000 if match else time.perf_counter() - start)
+        return True
     except Exception:
+        WATCHDOG_FAILURES.inc()
         return False
 
 def watchdog():
@@ -169,9 +351,6 @@ def watchdog():
         print(f"[Watchdog] Verbindung zu Handy ({handy_ip}): {'OK' if connection_ok else 'FEHLT'}")
         time.sleep(2)  # alle 2 Sekunden checken
 
-# Starte den Watchdog beim Boot
-threading.Thread(target=watchdog, daemon=True).start()
-
 def send_precise_pulse(pin, t_on_us):
     """
     Erzeugt einen einzelnen HIGH-Puls mit exakter Länge (t_on_us) auf dem angegebenen Pin.
@@ -190,6 +369,15 @@ def send_precise_pulse(pin, t_on_us):
             pass
         pi.wave_delete(wid)
 
+def fire_pulse(pin, t_on_us):
+    """
+    Einzelner Puls: bis 100 µs per gpio_trigger, darüber per Wave-API.
+    """
+    if t_on_us <= 100:
+        pi.gpio_trigger(pin, t_on_us, 1)
+    else:
+        send_precise_pulse(pin, t_on_us)
+
 def set_pwm(t_on_us, t_off_ms):
     if t_on_us > MAX_T_ON:
         t_on_us = MAX_T_ON  # Begrenze t_ON auf 100 µs
@@ -207,7 +395,7 @@ def set_pwm(t_on_us, t_off_ms):
     # Setze die Hardware-PWM-Frequenz und den Duty Cycle
     pi.hardware_PWM(INTERRUPTER_PIN, int(frequency), int(duty_cycle))  # Duty Cycle in Millionstel von 1
 
-@app.route('/set_burst', methods=['POST'])
+@bp.route('/set_burst', methods=['POST'])
 def set_burst():
     """
     Setzt BPS (Bursts pro Sekunde) und t_ON (in Mikrosekunden) für den Burst-Modus.
@@ -221,6 +409,7 @@ def set_burst():
 
         if t_on == 0:
             _stop_all_outputs()
+            session.RECORDER.record(session.OFF, INTERRUPTER_PIN)
             burst_active = False
             return jsonify({
                 "status": "success",
@@ -258,6 +447,8 @@ def set_burst():
         duty_cycle = int((t_on / 1000) / period_ms * 1_000_000)  # für pigpio
 
         pi.hardware_PWM(INTERRUPTER_PIN, frequency, duty_cycle)
+        session.RECORDER.record(session.PWM, INTERRUPTER_PIN, frequency, duty_cycle)
+        MODE_TIMER.set('burst')
         burst_active = True
 
         return jsonify({
@@ -274,7 +465,7 @@ def set_burst():
     
 
 
-@app.route('/burst_status', methods=['GET'])
+@bp.route('/burst_status', methods=['GET'])
 def burst_status():
     """
     Gibt den aktuellen Status des Burst-Modus zurück.
@@ -287,7 +478,7 @@ def burst_status():
 
 
 
-@app.route('/softstart_status', methods=['GET'])
+@bp.route('/softstart_status', methods=['GET'])
 def softstart_status():
     """
     Gibt den aktuellen Fortschritt des Softstarts zurück.
@@ -327,7 +518,7 @@ def softstart_sequence():
     finally:
         softstart_active = False
     
-@app.route('/start_softstart', methods=['POST'])
+@bp.route('/start_softstart', methods=['POST'])
 def start_softstart():
     """
     Startet den Softstart in einem separaten Thread.
@@ -341,15 +532,16 @@ def start_softstart():
     return jsonify({"status": "Softstart gestartet"})
 
 
-@app.route('/stop_midi', methods=['POST'])
+@bp.route('/stop_midi', methods=['POST'])
 def stop_midi():
-    global is_playing
-    is_playing = False
+    _stop_playback()
     pi.hardware_PWM(INTERRUPTER_PIN, 0, 0)
+    session.RECORDER.record(session.PWM, INTERRUPTER_PIN, 0, 0)
+    MODE_TIMER.set('off')
     return jsonify({'status': 'success', 'message': 'Wiedergabe gestoppt'})
 
 
-@app.route('/set_ton_toff', methods=['POST'])
+@bp.route('/set_ton_toff', methods=['POST'])
 def set_ton_toff():
     t_on = request.form.get('t_on', type=int)
     t_off = request.form.get('t_off', type=int)
@@ -358,6 +550,7 @@ def set_ton_toff():
         return jsonify({"status": "error", "message": "t_ON oder t_OFF fehlt"}), 400
     if t_on == 0:
         _stop_all_outputs()
+        session.RECORDER.record(session.OFF, INTERRUPTER_PIN)
         return jsonify({"status": "success", "message": "t_ON = 0 µs, Interrupter deaktiviert"})
     if t_on < 0 or t_off <= 0:
         return jsonify({"status": "error", "message": "t_ON oder t_OFF ungültig"}), 400
@@ -368,10 +561,12 @@ def set_ton_toff():
     frequency = 1_000 / t_total_ms  # Frequenz in Hertz
     duty_cycle = (t_on / 1_000) / t_total_ms * 1_000_000  # Duty Cycle
     pi.hardware_PWM(INTERRUPTER_PIN, int(frequency), int(duty_cycle))
+    session.RECORDER.record(session.PWM, INTERRUPTER_PIN, int(frequency), int(duty_cycle))
+    MODE_TIMER.set('ton_toff')
     
     return jsonify({"status": "success", "message": f"t_ON: {t_on} µs, t_OFF: {t_off} µs"})
 
-@app.route('/set_duty_cycle', methods=['POST'])
+@bp.route('/set_duty_cycle', methods=['POST'])
 def set_duty_cycle():
     duty_cycle = request.form.get('duty_cycle', type=float)  # Duty Cycle in Prozent
     frequency = request.form.get('frequency', type=int)  # Frequenz in Hz
@@ -380,6 +575,7 @@ def set_duty_cycle():
         return jsonify({"status": "error", "message": "Ungültige Eingabedaten"}), 400
     if duty_cycle <= 0:
         _stop_all_outputs()
+        session.RECORDER.record(session.OFF, INTERRUPTER_PIN)
         return jsonify({"status": "success", "message": "Duty Cycle = 0%, Interrupter deaktiviert"}), 200
 
     # Berechne die on-time in Mikrosekunden
@@ -393,13 +589,16 @@ def set_duty_cycle():
     # Setze die PWM entsprechend
     duty_cycle_million = int(duty_cycle * 10_000)  # Umrechnung für pigpio (0 - 1 Million)
     pi.hardware_PWM(INTERRUPTER_PIN, frequency, duty_cycle_million)
+    session.RECORDER.record(session.PWM, INTERRUPTER_PIN, frequency, duty_cycle_million)
+    MODE_TIMER.set('duty_cycle')
 
     return jsonify({"status": "success", "message": f"Duty Cycle = {duty_cycle}%, Frequenz = {frequency} Hz, t_ON = {t_on_us:.2f} µs"}), 200
 
-@app.route('/single_shot', methods=['POST'])
+@bp.route('/single_shot', methods=['POST'])
 def single_shot():
     # Stellen Sie sicher, dass der Pin initial LOW ist
     pi.write(INTERRUPTER_PIN, 0)
+    session.RECORDER.record(session.LEVEL, INTERRUPTER_PIN, 0)
     t_on = request.form.get('t_on', type=int)  # t_ON in µs
     print(f"t_ON: {t_on} empfangen")
 
@@ -411,10 +610,9 @@ def single_shot():
         }), 400
 
     try:
-        if t_on <= 100:
-            pi.gpio_trigger(INTERRUPTER_PIN, t_on, 1)
-        else:
-            send_precise_pulse(INTERRUPTER_PIN, t_on)
+        fire_pulse(INTERRUPTER_PIN, t_on)
+        session.RECORDER.record(session.PULSE, INTERRUPTER_PIN, t_on)
+        SINGLE_SHOTS.inc()
 
         return jsonify({
             "status": "success",
@@ -428,25 +626,196 @@ def single_shot():
             "message": f"Fehler beim Ausführen des Single Shot: {str(e)}"
         }), 500
 
-# Stellen Sie sicher, dass der Pin initial LOW ist
+def output_limits():
+    """
+    (max. t_ON in µs, Duty-Budget in %, Sperrzeit in µs) pro Interrupter-Ausgang.
+    """
+    limits = [(MIDI_MAX_T_ON, MAX_DUTY_CYCLE, NOTE_BLOCK_TIME_US)]
+    if DUAL_OUTPUT:
+        limits.append((OUTPUT2_MAX_T_ON, OUTPUT2_MAX_DUTY_CYCLE, OUTPUT2_BLOCK_TIME_US))
+    return limits
 
-pi.write(INTERRUPTER_PIN, 0)
 
-@app.route('/play_midi', methods=['POST'])
+def prepare_song(filepath, auto_fit=False, thin=False, events=None, limits=None):
+    """
+    Lädt einen Song für die Wiedergabe (oder nimmt die übergebenen events):
+    optional ans Duty-Budget anpassen, danach (OPTIMIZE_EVENTS) überflüssige
+    Hardware-Updates entfernen. limits wie in output_limits(), Standard ist
+    Ausgang 1. Liefert (Events, t_ON pro Event oder None, Meldung).
+    """
+    import songs
+    if events is None:
+        events = songs.load_events(filepath)
+    max_t_on, max_duty, block_time_us = limits or output_limits()[0]
+    t_on_us = None
+    notes = []
+    if auto_fit:
+        thin_gap_ms = MIDI_NOTE_RATE_LIMIT if thin else None
+        events, t_on_us, report = songs.fit_to_budget(
+            events, max_t_on, block_time_us, max_duty, thin_gap_ms=thin_gap_ms, transpose=MIDI_TRANSPOSE)
+        notes.append(f"angepasst: max. Duty {report['max_duty_percent_after']:.2f}%, "
+                     f"t_ON {report['min_t_on_us']}-{max_t_on} µs, {report['thinned_notes']} Noten ausgedünnt")
+    if OPTIMIZE_EVENTS:
+        events, t_on_us, report = songs.optimize_events(events, block_time_us, t_on_us)
+        logger.info(f"Optimiert: {report['events_before']} -> {report['events_after']} Events, "
+                    f"{report['pigpio_calls_before']} -> {report['pigpio_calls_after']} pigpio-Aufrufe")
+        notes.append(f"{report['pigpio_calls_before'] - report['pigpio_calls_after']} pigpio-Aufrufe eingespart")
+    return events, t_on_us, ", ".join(notes)
+
+
+def prepare_playback(filepath, auto_fit=False, thin=False):
+    """
+    Wie prepare_song(). Mit DUAL_OUTPUT wird der Song auf zwei Stimmen
+    verteilt, jede mit den Grenzen ihres Ausgangs vorbereitet und wieder zu
+    einer Zeitleiste zusammengeführt. Liefert (Events, t_ON pro Event oder
+    None, Ausgang pro Event oder None, Meldung).
+    """
+    if not DUAL_OUTPUT:
+        events, t_on_us, notes = prepare_song(filepath, auto_fit, thin)
+        return events, t_on_us, None, notes
+    import songs
+    parts = songs.split_voices(songs.load_events(filepath), 2)
+    prepared = [prepare_song(filepath, auto_fit, thin, events=part, limits=limits)
+                for part, limits in zip(parts, output_limits())]
+    events, t_on_us, outputs = songs.merge_voices([p[0] for p in prepared], [p[1] for p in prepared])
+    notes = "; ".join(f"Ausgang {i + 1}: {p[2]}" for i, p in enumerate(prepared) if p[2])
+    return events, t_on_us, outputs, notes
+
+
+@bp.route('/play_midi', methods=['POST'])
 def play_midi():
+    """
+    Startet die Wiedergabe. Mit auto_fit=1 wird der Song vorher so umgeschrieben,
+    dass er MAX_DUTY_CYCLE einhält (t_ON pro Note senken, mit thin=1 zusätzlich
+    schnelle Läufe ausdünnen).
+    """
     global is_playing
+    if engine_process is not None:
+        return _play_midi_in_engine()
     if is_playing:
         return jsonify({'status': 'error', 'message': 'Wiedergabe läuft bereits'})
     try:
         filepath = os.path.join(MIDI_FILES_DIR, request.form.get('midi_file', ''))
+        events, t_on_us, outputs, notes = prepare_playback(filepath,
+                                                           auto_fit=request.form.get('auto_fit', type=int),
+                                                           thin=request.form.get('thin', type=int))
+        message = f"Wiedergabe gestartet ({notes})" if notes else 'Wiedergabe gestartet'
         is_playing = True
-        threading.Thread(target=play_midi_file, args=(filepath,), daemon=True).start()
-        return jsonify({'status': 'success', 'message': 'Wiedergabe gestartet'})
+        MODE_TIMER.set('midi')
+        threading.Thread(target=play_midi_file, args=(filepath, events, t_on_us),
+                         kwargs={'outputs': outputs}, daemon=True).start()
+        return jsonify({'status': 'success', 'message': message})
     except Exception as e:
         is_playing = False
         return jsonify({'status': 'error', 'message': str(e)})
 
 
+def _play_midi_in_engine():
+    if not engine_process.alive():
+        return jsonify({'status': 'error', 'message': 'Engine nicht bereit'}), 503
+    status = engine_process.status()
+    if status and status['playing']:
+        return jsonify({'status': 'error', 'message': 'Wiedergabe läuft bereits'})
+    midi_file = request.form.get('midi_file', '')
+    if not _song_exists(os.path.join(MIDI_FILES_DIR, midi_file)):
+        return jsonify({'status': 'error', 'message': f"Datei nicht gefunden: {midi_file}"})
+    if not engine_process.play(midi_file, auto_fit=request.form.get('auto_fit', type=int),
+                               thin=request.form.get('thin', type=int)):
+        return jsonify({'status': 'error', 'message': 'Engine ausgelastet'}), 503
+    MODE_TIMER.set('midi')
+    return jsonify({'status': 'success', 'message': 'Wiedergabe gestartet'})
+
+
+def _stop_playback():
+    """
+    Beendet eine laufende Wiedergabe, egal ob als Thread oder im Engine-Prozess.
+    """
+    global is_playing
+    is_playing = False
+    if engine_process is not None:
+        engine_process.stop()
+
+
+def _engine_failed(reason):
+    logger.error(f"[Engine] {reason}, Ausgänge werden abgeschaltet")
+    if hardware_ready.wait(HARDWARE_WAIT_S):
+        _stop_all_outputs()
+
+
+def _engine_stopped():
+    if MODE_TIMER.states[MODE_TIMER.current] in ('midi', 'session'):
+        MODE_TIMER.set('off')
+
+
+@bp.route('/analyze_midi', methods=['GET'])
+def analyze_midi():
+    """
+    Vorab-Analyse eines Songs: Duty/Energie pro Fenster, Notendichte, geblockte
+    und begrenzte Noten. Passt der Song nicht ins Duty-Budget, enthält die
+    Antwort einen Vorschlag für die Umschreibung (siehe /play_midi auto_fit).
+    """
+    import songs
+    filepath = os.path.join(MIDI_FILES_DIR, request.args.get('midi_file', ''))
+    thin = request.args.get('thin', type=int)
+    try:
+        analysis = songs.analyze_song(filepath, MIDI_MAX_T_ON, NOTE_BLOCK_TIME_US, MAX_DUTY_CYCLE,
+                                      transpose=MIDI_TRANSPOSE)
+    except OSError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 404
+
+    result = {'status': 'success', 'analysis': analysis['summary']}
+    if request.args.get('windows', type=int):
+        result['window_ms'] = analysis['window_ms']
+        result['duty_percent'] = (analysis['duty'] * 100).round(3).tolist()
+        result['on_time_us'] = analysis['on_time_us'].round(1).tolist()
+        result['notes_per_s'] = analysis['density'].tolist()
+    events = songs.load_events(filepath)
+    if not analysis['summary']['fits_budget'] or thin:
+        _, _, report = songs.fit_to_budget(
+            events, MIDI_MAX_T_ON, NOTE_BLOCK_TIME_US, MAX_DUTY_CYCLE,
+            thin_gap_ms=MIDI_NOTE_RATE_LIMIT if thin else None, transpose=MIDI_TRANSPOSE)
+        result['proposal'] = report
+    result['optimization'] = songs.optimize_events(events, NOTE_BLOCK_TIME_US)[2]
+    if DUAL_OUTPUT:
+        # Aufteilung auf beide Ausgänge, jede Stimme gegen das Budget ihres Ausgangs
+        parts = songs.split_voices(events, 2)
+        result['outputs'] = [songs.analyze_events(part, max_t_on, block_time_us, max_duty,
+                                                  transpose=MIDI_TRANSPOSE)['summary']
+                             for part, (max_t_on, max_duty, block_time_us) in zip(parts, output_limits())]
+    return jsonify(result)
+
+
+@bp.route('/preview_audio.wav', methods=['GET'])
+def preview_audio():
+    """
+    Hörprobe: synthetisiert die Pulsfolge, die play_midi_file() ausgeben würde,
+    als WAV (16 Bit mono) und streamt sie blockweise. Gleiche Parameter wie
+    /play_midi (midi_file, auto_fit, thin), Transponierung wie eingestellt.
+    """
+    import audio
+    import songs
+    filepath = os.path.join(MIDI_FILES_DIR, request.args.get('midi_file', ''))
+    auto_fit = request.args.get('auto_fit', type=int)
+    thin = request.args.get('thin', type=int)
+    try:
+        events = songs.load_events(filepath)
+    except OSError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 404
+    # Mit DUAL_OUTPUT beide Ausgänge (je eine Stimme mit eigenen Grenzen) gemischt
+    limits = output_limits()
+    parts = songs.split_voices(events, 2) if DUAL_OUTPUT else [events]
+    voices = []
+    for part, (max_t_on, max_duty, block_time_us) in zip(parts, limits):
+        part, t_on_us, _ = prepare_song(filepath, auto_fit, thin, events=part,
+                                        limits=(max_t_on, max_duty, block_time_us))
+        voices.append((part, t_on_us if t_on_us is not None else max_t_on, block_time_us))
+    wav = audio.render_wav(voices, transpose=MIDI_TRANSPOSE)
+    header = next(wav)
+    response = Response(itertools.chain((header,), wav), mimetype='audio/wav')
+    response.headers['Content-Length'] = str(len(header) + struct.unpack_from('<I', header, 40)[0])
+    return response
+
+
 def send_pulse(t_on, frequency):
     # Konfiguriere Hardware PWM für den Interrupt-Pin
     pi.hardware_PWM(INTERRUPTER_PIN, frequency, int(t_on * 10000))  # Frequenz und Duty Cycle
@@ -457,75 +826,266 @@ def send_pulse(t_on, frequency):
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-def play_midi_file(filepath):
+def play_midi_file(filepath, events=None, t_on_us=None, start_at_ns=None, outputs=None):
+    """
+    Spielt einen Song ab. events/t_on_us kommen optional aus songs.fit_to_budget(),
+    t_on_us enthält dann eine t_ON (µs) pro Event statt MIDI_MAX_T_ON (0 = aktueller Höchstwert).
+    start_at_ns (perf_counter_ns) legt den Songbeginn fest, z.B. für den Flottenbetrieb.
+    outputs (aus prepare_playback()) gibt pro Event den Ausgang an (0 oder 1); jeder
+    Ausgang ist für sich monophon und hat eigene Sperrzeit und t_ON-Grenze.
+    Jedes Event wird um den kalibrierten Vorlauf (pigpio_latency['lead_us']) früher
+    ausgegeben; Soll-Zeitpunkte und Verspätung beziehen sich auf die Ankunft am Pin.
+    Die Soll-Zeitpunkte hängen am Songbeginn, Verspätungen summieren sich nicht auf
+    (wichtig für den Gleichlauf der Flotte).
+    """
     global is_playing
+    import songs
     logger.info(f"Starte Wiedergabe der Datei: {filepath}")
-    last_note_time = time.perf_counter_ns()
-    last_trigger_time = 0
-    active_note = None  # Monophone Mode
+    if REALTIME_PLAYBACK:
+        import realtime
+        realtime_status.update(realtime.apply(REALTIME_PRIORITY, REALTIME_CPU))
+        gc.disable()
+    stats = _reset_playback_stats()
+    cpu_base = stats['cpu_s']
+    cpu_start = time.thread_time()
+    spin_ns = REALTIME_SPIN_US * 1000 if REALTIME_PLAYBACK else None
+    tracer = tracing.TRACER
+    trace_prev = None  # (Typ, Note, Soll-Zeit, Verspätung) des vorherigen Events
+    target_time = start_at_ns if start_at_ns is not None else time.perf_counter_ns()
+    stats['start_ns'] = target_time
+    lead_ns = int(pigpio_latency['lead_us'] * 1000)  # für den ganzen Song fest
+    woke_ns = target_time
+    pins = (INTERRUPTER_PIN, INTERRUPTER2_PIN)
+    last_trigger_time = [0, 0]
+    active_note = [None, None]  # Monophon pro Ausgang
+    last_pwm = [(0, 0), (0, 0)]  # Zuletzt gesetzte (Frequenz, Duty), um gleiche Aufrufe zu sparen
     try:
-        with open(filepath, 'rb') as f:
-            for chunk in iter(lambda: f.read(5), b''):
-                if not is_playing:
-                    break
-                dt, ev_type, note, vel = struct.unpack('<HBBB', chunk)
-                target_time = last_note_time + int(dt * 1_000_000)
-                while time.perf_counter_ns() < target_time:
-                    pass
-                last_note_time = time.perf_counter_ns()
-
-                timestamp = time.strftime("%H:%M:%S", time.localtime())
-
-                if ev_type == 0x90:
-                    logger.info(f"[{timestamp}] NOTE_ON: {note}, Velocity: {vel}")
-
-                    now_ns = time.perf_counter_ns()
-                    if now_ns - last_trigger_time < NOTE_BLOCK_TIME_US * 1000:
-                        logger.info(f"{note} geblockt durch Hard-Off-Time")
-                        continue
-
-                    active_note = note
-                    if FORCE_GPIO_TRIGGER:
-                        pi.gpio_trigger(INTERRUPTER_PIN, MIDI_MAX_T_ON, 1)
-                    else:
-                        freq = midi_note_to_frequency(note)
-                        period = 1.0 / freq
-                        max_on_time_s = MIDI_MAX_T_ON / 1_000_000.0
-                        duty = calculate_max_duty_cycle(freq, MIDI_MAX_T_ON)
-
-                        actual_on_time = duty / 1_000_000 * period
-                        if actual_on_time > max_on_time_s:
-                            duty = int((max_on_time_s / period) * 1_000_000)
-                            logger.info(f"t_ON begrenzt auf {max_on_time_s * 1e6:.1f} µs bei {freq:.1f} Hz")
-
-                        pi.hardware_PWM(INTERRUPTER_PIN, int(freq), duty)
-                    last_trigger_time = time.perf_counter_ns()
-
-                elif ev_type == 0x80 and note == active_note:
-                    logger.info(f"[{timestamp}] NOTE_OFF: {note}")
-                    pi.hardware_PWM(INTERRUPTER_PIN, 0, 0)
-                    active_note = None
+        if events is None:
+            events = songs.load_events(filepath)
+        t_on_list = t_on_us.tolist() if t_on_us is not None else None
+        out_list = outputs.tolist() if outputs is not None else None
+        stats['total'] = len(events)
+        for i, (dt, ev_type, note, vel) in enumerate(events.tolist()):
+            if trace_prev is not None and tracer.active:
+                # Span des vorherigen Events: Aufwachen bis Ende der Verarbeitung
+                _trace_event(tracer, trace_prev, woke_ns)
+            if not is_playing:
+                break
+            stats['position'] = i
+            stats['cpu_s'] = cpu_base + time.thread_time() - cpu_start
+            target_time += dt * 1_000_000
+            woke_ns = _wait_until(target_time - lead_ns, spin_ns)
+            # erwartete Ankunft am Pin
+            late_us = (woke_ns + lead_ns - target_time) / 1000
+            _count_lateness(stats, late_us)
+            trace_prev = (ev_type, note, target_time, late_us)
+
+            timestamp = time.strftime("%H:%M:%S", time.localtime())
+            out = out_list[i] if out_list is not None else 0
+
+            if ev_type == 0x90:
+                logger.info(f"[{timestamp}] NOTE_ON: {note}, Velocity: {vel}")
+
+                now_ns = time.perf_counter_ns()
+                block_time_us = NOTE_BLOCK_TIME_US if out == 0 else OUTPUT2_BLOCK_TIME_US
+                if now_ns - last_trigger_time[out] < block_time_us * 1000:
+                    logger.info(f"{note} geblockt durch Hard-Off-Time")
+                    continue
+
+                active_note[out] = note
+                if out == 0:
+                    stats['active_note'] = note
+                t_on = (t_on_list[i] if t_on_list is not None else 0) or (MIDI_MAX_T_ON if out == 0 else OUTPUT2_MAX_T_ON)
+                if FORCE_GPIO_TRIGGER:
+                    pi.gpio_trigger(pins[out], t_on, 1)
+                else:
+                    freq = midi_note_to_frequency(note + MIDI_TRANSPOSE)
+                    period = 1.0 / freq
+                    max_on_time_s = t_on / 1_000_000.0
+                    duty = calculate_max_duty_cycle(freq, t_on)
+
+                    actual_on_time = duty / 1_000_000 * period
+                    if actual_on_time > max_on_time_s:
+                        duty = int((max_on_time_s / period) * 1_000_000)
+                        logger.info(f"t_ON begrenzt auf {max_on_time_s * 1e6:.1f} µs bei {freq:.1f} Hz")
+
+                    if (int(freq), duty) != last_pwm[out]:
+                        pi.hardware_PWM(pins[out], int(freq), duty)
+                        last_pwm[out] = (int(freq), duty)
+                last_trigger_time[out] = time.perf_counter_ns()
+                stats['last_note_late_us'] = (last_trigger_time[out] - target_time) / 1000
+                if stats['first_note_late_us'] is None:
+                    stats['first_note_late_us'] = stats['last_note_late_us']
+
+            elif ev_type == 0x80 and note == active_note[out]:
+                logger.info(f"[{timestamp}] NOTE_OFF: {note}")
+                if last_pwm[out] != (0, 0):
+                    pi.hardware_PWM(pins[out], 0, 0)
+                    last_pwm[out] = (0, 0)
+                active_note[out] = None
+                if out == 0:
+                    stats['active_note'] = None
+
+        if trace_prev is not None and tracer.active:
+            _trace_event(tracer, trace_prev, woke_ns)
 
     except Exception as e:
         logger.error(f"Fehler beim Abspielen der Datei: {e}")
     finally:
         is_playing = False
+        stats['active_note'] = None
         pi.hardware_PWM(INTERRUPTER_PIN, 0, 0)
+        if outputs is not None:
+            pi.hardware_PWM(INTERRUPTER2_PIN, 0, 0)
+        if MODE_TIMER.states[MODE_TIMER.current] == 'midi':
+            MODE_TIMER.set('off')
+        if REALTIME_PLAYBACK:
+            gc.enable()
         logger.info("Wiedergabe abgeschlossen oder abgebrochen.")
 
 
+def _reset_playback_stats(total=0):
+    stats = playback_stats
+    stats.update(events=0, lateness_sum_us=0.0, lateness_max_us=0.0,
+                 lateness_buckets=[0] * (len(LATENESS_BUCKETS_US) + 1),
+                 position=0, total=total, active_note=None, first_note_late_us=None, last_note_late_us=None)
+    return stats
+
+
+def _wait_until(wake_ns, spin_ns):
+    """
+    Wartet bis wake_ns (perf_counter_ns), im Echtzeit-Modus nur die letzten spin_ns aktiv.
+    Liefert den tatsächlichen Zeitpunkt.
+    """
+    if spin_ns is not None:
+        remaining = wake_ns - time.perf_counter_ns() - spin_ns
+        if remaining > 0:
+            time.sleep(remaining / 1e9)
+    while time.perf_counter_ns() < wake_ns:
+        pass
+    return time.perf_counter_ns()
+
+
+def _count_lateness(stats, late_us):
+    stats['events'] += 1
+    stats['lateness_sum_us'] += late_us
+    if late_us > stats['lateness_max_us']:
+        stats['lateness_max_us'] = late_us
+    b = 0
+    while b < len(LATENESS_BUCKETS_US) and late_us > LATENESS_BUCKETS_US[b]:
+        b += 1
+    stats['lateness_buckets'][b] += 1
+
+
+def load_session(name):
+    """
+    Lädt eine aufgezeichnete Session und prüft sie gegen die aktuellen Grenzen.
+    Wirft OSError bzw. ValueError.
+    """
+    events = session.load(session.session_path(name))
+    validate_session(events)
+    return events
+
+
+def validate_session(events):
+    """
+    Prüft Session-Events gegen GPIOs und MAX_T_ON (wirft ValueError), wie vor der Wiedergabe.
+    """
+    pins = (INTERRUPTER_PIN, INTERRUPTER2_PIN) if DUAL_OUTPUT else (INTERRUPTER_PIN,)
+    session.validate(events, pins, MAX_T_ON)
+
+
+def play_session(name, events):
+    """
+    Spielt eine aufgezeichnete Session (session.py) ab, im selben Rahmen wie
+    play_midi_file(): Echtzeit-Modus, Vorlauf für die pigpio-Laufzeit,
+    Verspätungsstatistik, Abbruch über is_playing. Die Soll-Zeitpunkte hängen
+    am Sessionbeginn, Verspätungen summieren sich nicht auf. Am Ende werden
+    alle Ausgänge abgeschaltet.
+    """
+    global is_playing
+    logger.info(f"Starte Wiedergabe der Session: {name}")
+    if REALTIME_PLAYBACK:
+        import realtime
+        realtime_status.update(realtime.apply(REALTIME_PRIORITY, REALTIME_CPU))
+        gc.disable()
+    stats = _reset_playback_stats(len(events))
+    cpu_base = stats['cpu_s']
+    cpu_start = time.thread_time()
+    spin_ns = REALTIME_SPIN_US * 1000 if REALTIME_PLAYBACK else None
+    lead_ns = int(pigpio_latency['lead_us'] * 1000)
+    target_ns = time.perf_counter_ns()
+    stats['start_ns'] = target_ns
+    try:
+        for i, (dt, ev_type, pin, a, b) in enumerate(events.tolist()):
+            if not is_playing:
+                break
+            stats['position'] = i
+            target_ns += dt
+            if ev_type == session.FILLER:
+                continue
+            woke_ns = _wait_until(target_ns - lead_ns, spin_ns)
+            _count_lateness(stats, (woke_ns + lead_ns - target_ns) / 1000)
+            if ev_type == session.PWM:
+                pi.hardware_PWM(pin, a, b)
+            elif ev_type == session.PULSE:
+                fire_pulse(pin, a)
+            elif ev_type == session.LEVEL:
+                pi.write(pin, a)
+            elif ev_type == session.OFF:
+                _stop_all_outputs()
+                MODE_TIMER.set('session')
+    except Exception as e:
+        logger.error(f"Fehler beim Abspielen der Session: {e}")
+    finally:
+        is_playing = False
+        _stop_all_outputs()
+        stats['cpu_s'] = cpu_base + time.thread_time() - cpu_start
+        if REALTIME_PLAYBACK:
+            gc.enable()
+        logger.info("Session-Wiedergabe abgeschlossen oder abgebrochen.")
+
+
+def _trace_event(tracer, prev, wake_ns):
+    ev_type, note, target_ns, late_us = prev
+    tracer.complete(TRACE_EVENT_NAMES.get(ev_type, 'event'), 'playback', wake_ns, time.perf_counter_ns(),
+                    {'note': note, 'late_us': late_us, 'target_us': target_ns / 1000})
+
+
 def midi_note_to_frequency(note):
     """ Berechnet die Frequenz der MIDI-Note """
     return 440.0 * 2.0 ** ((note - 69) / 12.0)  # Standardmäßige MIDI-Tonhöhenformel
 
-@app.route('/set_midi_max_t_on', methods=['POST'])
+@bp.route('/set_midi_max_t_on', methods=['POST'])
 def set_midi_max_t_on():
-    global MIDI_MAX_T_ON
+    """
+    Setzt die max. t_ON für MIDI, mit output=2 für den zweiten Ausgang (DUAL_OUTPUT).
+    """
+    global MIDI_MAX_T_ON, OUTPUT2_MAX_T_ON
     new_ton = request.form.get('max_t_on', type=int)
+    output = request.form.get('output', 1, type=int)
     if new_ton is None or new_ton <= 0 or new_ton > MAX_T_ON:
         return jsonify({'status': 'error', 'message': f"max_t_on muss zwischen 1 und {MAX_T_ON} µs liegen"}), 400
-    MIDI_MAX_T_ON = new_ton
-    return jsonify({'status': 'success', 'message': f"max_t_on auf {MIDI_MAX_T_ON} µs gesetzt"})
+    if output not in (1, 2) or (output == 2 and not DUAL_OUTPUT):
+        return jsonify({'status': 'error', 'message': f"Ausgang {output} nicht vorhanden"}), 400
+    if output == 1:
+        MIDI_MAX_T_ON = new_ton
+    else:
+        OUTPUT2_MAX_T_ON = new_ton
+    if engine_process is not None:
+        engine_process.set_max_t_on(new_ton, output)
+    return jsonify({'status': 'success', 'message': f"max_t_on (Ausgang {output}) auf {new_ton} µs gesetzt"})
+
+@bp.route('/set_transpose', methods=['POST'])
+def set_transpose():
+    global MIDI_TRANSPOSE
+    semitones = request.form.get('semitones', type=int)
+    if semitones is None or abs(semitones) > 24:
+        return jsonify({'status': 'error', 'message': "semitones muss zwischen -24 und 24 liegen"}), 400
+    MIDI_TRANSPOSE = semitones
+    if engine_process is not None:
+        engine_process.set_transpose(semitones)
+    return jsonify({'status': 'success', 'message': f"Transponierung auf {semitones} Halbtöne gesetzt"})
 
 def calculate_max_duty_cycle(freq, max_t_on):
     period = 1.0 / freq
@@ -533,14 +1093,49 @@ def calculate_max_duty_cycle(freq, max_t_on):
     duty = (on_time / period) * 1_000_000
     return min(int(duty), 1_000_000)
 
-@app.route('/playback_status', methods=['GET'])
+@bp.route('/playback_status', methods=['GET'])
 def playback_status():
-    return jsonify({'playing': is_playing})
+    stats = playback_stats
+    playing = is_playing
+    realtime = {'enabled': REALTIME_PLAYBACK, **realtime_status}
+    latency = pigpio_latency
+    if engine_process is not None:
+        stats = engine_process.status() or stats
+        playing = stats.get('playing', False)
+        realtime = {'enabled': REALTIME_PLAYBACK, **stats.get('realtime', {})}
+        latency = stats.get('pigpio_latency', latency)
+    calibrated_ns = latency.get('calibrated_ns')
+    events = stats['events']
+    return jsonify({
+        'playing': playing,
+        'engine': PLAYBACK_ENGINE,
+        'position': stats['position'],
+        'total': stats['total'],
+        'active_note': stats['active_note'],
+        'events': events,
+        'lateness_mean_us': stats['lateness_sum_us'] / events if events else 0.0,
+        'lateness_max_us': stats['lateness_max_us'],
+        'lateness_bucket_bounds_us': list(LATENESS_BUCKETS_US),
+        'lateness_buckets': stats['lateness_buckets'],
+        'realtime': realtime,
+        'pigpio_latency': {'compensation': LATENCY_COMPENSATION, 'lead_us': latency['lead_us'],
+                           **{k: latency.get(k) for k in ('median_us', 'p10_us', 'p90_us', 'rtt_median_us')},
+                           'age_s': round((time.perf_counter_ns() - calibrated_ns) / 1e9, 1) if calibrated_ns else None},
+        'dual_output': DUAL_OUTPUT,
+        'engine_pid': stats.get('pid'),
+    })
+
+def _song_exists(filepath):
+    return songpack.lookup(filepath) is not None or os.path.isfile(filepath)
 
-@app.route('/get_midi_files', methods=['GET'])
+
+@bp.route('/get_midi_files', methods=['GET'])
 def get_midi_files():
-    # Lese die Dateien im MIDI-Ordner
-    midi_files = [f for f in os.listdir(MIDI_FILES_DIR) if os.path.isfile(os.path.join(MIDI_FILES_DIR, f))]
+    # Mit Song-Pack kommt die Liste aus dessen Tabelle, sonst aus dem MIDI-Ordner
+    if songpack.PACK is not None:
+        midi_files = songpack.PACK.names()
+    else:
+        midi_files = [f for f in os.listdir(MIDI_FILES_DIR) if os.path.isfile(os.path.join(MIDI_FILES_DIR, f))]
 
     # Entferne eventuell vorhandene Dateiendungen (z.B. .dat)
     midi_files = [os.path.splitext(f)[0] for f in midi_files]
@@ -548,7 +1143,39 @@ def get_midi_files():
     return jsonify({'files': midi_files})
 
 
-@app.route('/toggle_power', methods=['POST'])
+@bp.route('/song_preview.png', methods=['GET'])
+def song_preview():
+    """
+    Piano-Roll mit Pulsfolge (t_ON, geblockte Noten, Duty pro Fenster) als PNG.
+    Parameter: midi_file, optional t_on (Standard MIDI_MAX_T_ON), auto_fit, width, height.
+    Gerendert wird in einem eigenen Prozess, Ergebnisse landen im Cache.
+    """
+    global preview_renderer
+    import render
+    if preview_renderer is None:
+        preview_renderer = render.PreviewRenderer()
+    filepath = os.path.join(MIDI_FILES_DIR, request.args.get('midi_file', ''))
+    t_on = request.args.get('t_on', MIDI_MAX_T_ON, type=int)
+    if t_on is None or t_on <= 0 or t_on > MAX_T_ON:
+        return jsonify({'status': 'error', 'message': f"t_on muss zwischen 1 und {MAX_T_ON} µs liegen"}), 400
+    size = [min(max(request.args.get(name, default, type=int), 100), render.MAX_SIZE)
+            for name, default in (('width', render.DEFAULT_WIDTH), ('height', render.DEFAULT_HEIGHT))]
+    try:
+        path = preview_renderer.preview(
+            filepath, t_on_us=t_on,
+            block_time_us=NOTE_BLOCK_TIME_US, max_duty_percent=MAX_DUTY_CYCLE,
+            auto_fit=bool(request.args.get('auto_fit', type=int)), transpose=MIDI_TRANSPOSE,
+            width=size[0], height=size[1])
+    except OSError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 404
+    except (TimeoutError, RuntimeError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+    response = send_file(os.path.abspath(path), mimetype='image/png')
+    response.headers['Cache-Control'] = 'max-age=3600'
+    return response
+
+
+@bp.route('/toggle_power', methods=['POST'])
 def toggle_power():
     """
     Schaltet die Relais für Softstart und Volllast ein und aus.
@@ -597,12 +1224,12 @@ def toggle_power():
             "power": power_active
         }), 500
 
-@app.route('/power_status', methods=['GET'])
+@bp.route('/power_status', methods=['GET'])
 def power_status():
     return jsonify({"power": get_power_state()})
         
 
-@app.route('/ping_status', methods=['GET'])
+@bp.route('/ping_status', methods=['GET'])
 def ping_status():
     handy_ip = "192.168.178.86"  # Deine Handy-IP
     try:
@@ -616,5 +1243,329 @@ def ping_status():
     return jsonify({"connection_ok": ok, "ping_ms": duration})
 
 
+# Routen, die ohne initialisierte Hardware beantwortet werden können
+_NO_HARDWARE_ENDPOINTS = {
+    'interrupter.index', 'interrupter.get_midi_files', 'interrupter.analyze_midi', 'interrupter.song_preview',
+    'interrupter.preview_audio',
+    'interrupter.playback_status', 'interrupter.burst_status',
+    'interrupter.softstart_status', 'interrupter.ping_status', 'interrupter.metrics_endpoint',
+    'interrupter.trace_start', 'interrupter.trace_stop', 'interrupter.trace_json', 'interrupter.fleet_status',
+    'interrupter.session_record_start', 'interrupter.session_record_stop', 'interrupter.session_status',
+    'static',
+}
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Kennzahlen im Prometheus-Textformat.
+    """
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _playback_cpu_seconds():
+    if engine_process is not None:
+        status = engine_process.status()
+        return status['cpu_s'] if status else 0.0
+    return playback_stats['cpu_s']
+
+
+METRICS.register(metrics.Callback(
+    'interrupter_playback_cpu_seconds_total', 'CPU-Zeit der Wiedergabe-Threads', 'counter', _playback_cpu_seconds))
+
+
+_request_counter = iter(range(1 << 62))
+
+
+def _metrics_start():
+    request.environ['interrupter.start'] = time.perf_counter_ns()
+
+
+def _metrics_record(response):
+    start = request.environ.get('interrupter.start')
+    if start is not None:
+        end = time.perf_counter_ns()
+        route = (request.endpoint or 'other').rpartition('.')[2]
+        HTTP_REQUESTS.labels(route).inc()
+        HTTP_LATENCY.labels(route).observe((end - start) / 1e9)
+    return response
+
+
+def _trace_record(response):
+    start = request.environ.get('interrupter.start')
+    if start is not None and tracing.TRACER.active and next(_request_counter) % TRACE_REQUEST_SAMPLE == 0:
+        route = (request.endpoint or 'other').rpartition('.')[2]
+        tracing.TRACER.complete(f"{request.method} {route}", 'http', start, time.perf_counter_ns(),
+                                {'status': response.status_code})
+    return response
+
+
+@bp.route('/trace/start', methods=['POST'])
+def trace_start():
+    """
+    Startet eine Profiling-Aufzeichnung (optional capacity = max. Anzahl Spans).
+    """
+    capacity = request.form.get('capacity', type=int)
+    if capacity is not None and capacity <= 0:
+        return jsonify({'status': 'error', 'message': 'capacity muss > 0 sein'}), 400
+    tracing.TRACER.start(capacity)
+    if engine_process is not None:
+        engine_process.trace_start()
+    return jsonify({'status': 'success', 'message': 'Aufzeichnung gestartet', **tracing.TRACER.summary()})
+
+
+@bp.route('/trace/stop', methods=['POST'])
+def trace_stop():
+    tracing.TRACER.stop()
+    if engine_process is not None:
+        engine_process.trace_stop()
+    return jsonify({'status': 'success', 'message': 'Aufzeichnung gestoppt', **tracing.TRACER.summary()})
+
+
+@bp.route('/trace.json', methods=['GET'])
+def trace_json():
+    """
+    Letzte Aufzeichnung als Chrome-Trace (chrome://tracing, ui.perfetto.dev).
+    Eine laufende Aufzeichnung wird dabei beendet.
+    """
+    if tracing.TRACER.active:
+        trace_stop()
+    events = tracing.TRACER.events(process_name='web')
+    if engine_process is not None:
+        events.extend(engine_process.trace_events())
+    trace = tracing.chrome_trace(events, {'song_engine': PLAYBACK_ENGINE, **tracing.TRACER.summary()})
+    response = jsonify(trace)
+    response.headers['Content-Disposition'] = 'attachment; filename=interrupter-trace.json'
+    return response
+
+
+@bp.route('/session/record/start', methods=['POST'])
+def session_record_start():
+    """
+    Startet die Aufnahme aller Ausgabeänderungen der Steuer-Routen
+    (optional capacity = max. Anzahl Events).
+    """
+    capacity = request.form.get('capacity', type=int)
+    if capacity is not None and capacity <= 0:
+        return jsonify({'status': 'error', 'message': 'capacity muss > 0 sein'}), 400
+    session.RECORDER.start(capacity)
+    return jsonify({'status': 'success', 'message': 'Aufnahme gestartet', **session.RECORDER.summary()})
+
+
+@bp.route('/session/record/stop', methods=['POST'])
+def session_record_stop():
+    """
+    Beendet die Aufnahme und speichert sie unter name (session.SESSION_DIR).
+    playable/problem melden, ob die Session die Grenzen für die Wiedergabe einhält.
+    """
+    name = request.form.get('name', '')
+    try:
+        path = session.session_path(name)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    session.RECORDER.stop()
+    events = session.RECORDER.events()
+    session.save(events, path)
+    # Schon beim Speichern melden, wenn die Session nicht abspielbar ist (z.B. /set_ton_toff über MAX_T_ON)
+    try:
+        validate_session(events)
+        message, problem = f"Session {name} gespeichert", None
+    except ValueError as e:
+        message, problem = f"Session {name} gespeichert, aber nicht abspielbar: {e}", str(e)
+    return jsonify({'status': 'success', 'message': message, 'playable': problem is None, 'problem': problem,
+                    'bytes': events.nbytes, **session.RECORDER.summary()})
+
+
+@bp.route('/session/status', methods=['GET'])
+def session_status():
+    return jsonify({**session.RECORDER.summary(), 'sessions': session.list_sessions()})
+
+
+@bp.route('/session/play', methods=['POST'])
+def session_play():
+    """
+    Spielt eine gespeicherte Session mit der Wiedergabe-Engine ab (Stopp über /stop_midi).
+    """
+    global is_playing
+    name = request.form.get('name', '')
+    try:
+        events = load_session(name)
+    except (OSError, ValueError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    if engine_process is not None:
+        if not engine_process.alive():
+            return jsonify({'status': 'error', 'message': 'Engine nicht bereit'}), 503
+        status = engine_process.status()
+        if status and status['playing']:
+            return jsonify({'status': 'error', 'message': 'Wiedergabe läuft bereits'})
+        if not engine_process.play(name, session=True):
+            return jsonify({'status': 'error', 'message': 'Engine ausgelastet'}), 503
+    else:
+        if is_playing:
+            return jsonify({'status': 'error', 'message': 'Wiedergabe läuft bereits'})
+        is_playing = True
+        threading.Thread(target=play_session, args=(name, events), daemon=True).start()
+    MODE_TIMER.set('session')
+    return jsonify({'status': 'success', 'message': f"Session {name} gestartet ({len(events)} Events)"})
+
+
+def _prepare_fleet_playback(filepath, events, auto_fit, thin):
+    """
+    Bereitet eine Stimme für den Flottenstart vor.
+    Liefert (Events, t_ON pro Event, Fehlermeldung oder None).
+    """
+    if is_playing:
+        return None, None, 'Wiedergabe läuft bereits'
+    events, t_on_us, _ = prepare_song(filepath, auto_fit=auto_fit, thin=thin, events=events)
+    return events, t_on_us, None
+
+
+def _start_fleet_playback(filepath, events, t_on_us, start_ns):
+    """
+    Startet eine vorbereitete Stimme zum Zeitpunkt start_ns (Leader-Zeit).
+    Liefert None oder eine Fehlermeldung.
+    """
+    global is_playing
+    if is_playing:
+        return 'Wiedergabe läuft bereits'
+    start_at_ns = fleet_node.to_local(start_ns)
+    if start_at_ns <= time.perf_counter_ns():
+        return 'Startzeitpunkt bereits verstrichen'
+    is_playing = True
+    MODE_TIMER.set('midi')
+    threading.Thread(target=play_midi_file, args=(filepath, events, t_on_us, start_at_ns), daemon=True).start()
+    return None
+
+
+@bp.route('/fleet/play', methods=['POST'])
+def fleet_play():
+    """
+    Leader: verteilt einen Song auf alle Knoten (eine Stimme pro Knoten) und
+    startet ihn überall FLEET_LEAD_MS (oder lead_ms) später gleichzeitig.
+    Die eigene Stimme wird vorbereitet und gestartet (der Thread wartet auf den
+    Startzeitpunkt), bevor die Follower angesprochen werden; die Follower
+    bekommen höchstens die Vorlaufzeit, um den Start zu bestätigen.
+    """
+    import fleet
+    import songs
+    if not isinstance(fleet_node, fleet.Leader):
+        return jsonify({'status': 'error', 'message': 'Kein Flotten-Leader'}), 409
+    midi_file = request.form.get('midi_file', '')
+    filepath = os.path.join(MIDI_FILES_DIR, midi_file)
+    auto_fit = request.form.get('auto_fit', type=int)
+    thin = request.form.get('thin', type=int)
+    lead_ms = request.form.get('lead_ms', FLEET_LEAD_MS, type=int)
+    if lead_ms <= 0:
+        return jsonify({'status': 'error', 'message': 'lead_ms muss größer als 0 sein'}), 400
+    try:
+        events = songs.load_events(filepath)
+    except OSError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 404
+    followers = fleet_node.active_followers()
+    voices = 1 + max((f['voice'] for _, f in followers), default=0)
+    parts = songs.split_voices(events, voices)
+    events, t_on_us, error = _prepare_fleet_playback(filepath, parts[0], auto_fit, thin)
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 409
+    start_ns = fleet_node.now() + lead_ms * 1_000_000
+    error = _start_fleet_playback(filepath, events, t_on_us, start_ns)
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 409
+    results = fleet.send_start(followers, parts, start_ns, midi_file, auto_fit, thin, timeout=lead_ms / 1000)
+    return jsonify({'status': 'success', 'message': f"Wiedergabe auf {voices} Stimmen gestartet",
+                    'start_ns': start_ns, 'voices': voices, 'followers': results})
+
+
+@bp.route('/fleet/start', methods=['POST'])
+def fleet_start():
+    """
+    Follower: Stimme (Event-Bytes im Body) zum Zeitpunkt start_ns (Leader-Zeit) abspielen.
+    """
+    import fleet
+    import songs
+    if not isinstance(fleet_node, fleet.Follower):
+        return jsonify({'status': 'error', 'message': 'Kein Flotten-Follower'}), 409
+    if not fleet_node.synced():
+        return jsonify({'status': 'error', 'message': 'Uhr nicht mit dem Leader abgeglichen'}), 409
+    start_ns = request.args.get('start_ns', type=int)
+    if start_ns is None:
+        return jsonify({'status': 'error', 'message': 'start_ns fehlt'}), 400
+    filepath = os.path.join(MIDI_FILES_DIR, request.args.get('song', ''))
+    events, t_on_us, error = _prepare_fleet_playback(filepath, songs.parse_events(request.get_data()),
+                                                     request.args.get('auto_fit', type=int),
+                                                     request.args.get('thin', type=int))
+    if not error:
+        error = _start_fleet_playback(filepath, events, t_on_us, start_ns)
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 409
+    return jsonify({'status': 'success', 'message': 'Start geplant'})
+
+
+@bp.route('/fleet/status', methods=['GET'])
+def fleet_status():
+    """
+    Rolle, Uhrabgleich und Stimme dieses Knotens. start_ns, first_note_late_us und
+    last_note_late_us (perf_counter_ns-Songbeginn, Verspätung der ersten und der
+    zuletzt gespielten Note) gehören zur letzten Wiedergabe.
+    """
+    status = fleet_node.status() if fleet_node is not None else {'role': None}
+    stats = playback_stats
+    return jsonify({**status, 'playing': is_playing, 'start_ns': stats['start_ns'],
+                    'first_note_late_us': stats['first_note_late_us'],
+                    'last_note_late_us': stats['last_note_late_us']})
+
+
+def _start_fleet_node():
+    global fleet_node
+    import fleet
+    if PLAYBACK_ENGINE != 'thread':
+        logger.error("Flottenbetrieb nur mit PLAYBACK_ENGINE = 'thread' möglich")
+    elif FLEET_ROLE == 'leader':
+        fleet_node = fleet.Leader(FLEET_PORT, sim_offset_ns=FLEET_SIM_OFFSET_NS)
+    elif FLEET_ROLE == 'follower':
+        host, _, port = FLEET_LEADER.partition(':')
+        fleet_node = fleet.Follower(host, HTTP_PORT, int(port or fleet.PORT), voice=FLEET_VOICE,
+                                    sim_offset_ns=FLEET_SIM_OFFSET_NS)
+    else:
+        logger.error(f"Unbekannte Flotten-Rolle: {FLEET_ROLE}")
+
+
+def _wait_for_hardware():
+    if request.endpoint in _NO_HARDWARE_ENDPOINTS:
+        return None
+    if not hardware_ready.wait(HARDWARE_WAIT_S):
+        return jsonify({'status': 'error', 'message': 'Hardware noch nicht bereit'}), 503
+    return None
+
+
+def create_app(init_hw=True):
+    """
+    Application Factory. Schwere Importe (NumPy, pigpio) passieren erst bei
+    Bedarf, die Hardware wird im Hintergrund initialisiert.
+    """
+    global engine_process
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+    songpack.use(SONG_PACK_PATH, MIDI_FILES_DIR)
+    if METRICS_ENABLED:
+        for rule in app.url_map.iter_rules():
+            route = rule.endpoint.rpartition('.')[2]
+            HTTP_REQUESTS.add(route)
+            HTTP_LATENCY.add(route)
+        app.after_request(_metrics_record)
+    app.before_request(_metrics_start)
+    app.after_request(_trace_record)
+    app.before_request(_wait_for_hardware)
+    if init_hw and not hardware_ready.is_set():
+        threading.Thread(target=init_hardware, daemon=True).start()
+    if PLAYBACK_ENGINE == 'process' and engine_process is None:
+        import engine
+        engine_process = engine.EngineProcess(on_failure=_engine_failed, on_stopped=_engine_stopped)
+    if FLEET_ROLE and fleet_node is None:
+        _start_fleet_node()
+    return app
+
+
 if __name__ == "__main__":
-    app.run(debug=True, host='0.0.0.0')
+    # Ohne Reloader: der würde den Prozess (und die Hardware-Initialisierung) doppelt starten
+    create_app().run(debug=True, host='0.0.0.0', port=HTTP_PORT, use_reloader=False)
@@ -0,0 +1,238 @@
+"""
+Kennzahlen im Prometheus-Textformat (/metrics).
+
+Alle Zähler und Histogramme werden beim Start mit ihren Label-Werten
+angelegt; das Erfassen selbst legt keine neuen Objekte an (nur Indizes in
+vorab erzeugte Listen). Unbekannte Label-Werte landen in 'other'.
+"""
+import bisect
+import threading
+import time
+
+LATENCY_BUCKETS_S = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+PIGPIO_BUCKETS_S = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01)
+
+OTHER = 'other'
+
+
+def _labels(names, values):
+    return ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self, name, labels):
+        sep = "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.bounds + (float('inf'),), self.counts):
+            cumulative += n
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{le}"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labels):
+        suffix = f"{{{labels}}}" if labels else ""
+        return [f"{name}{suffix} {self.value}"]
+
+
+class Gauge(Counter):
+    def set(self, value):
+        self.value = value
+
+
+class StateTimer:
+    """
+    Summiert, wie lange ein Zustand aktiv war. set() wechselt den Zustand.
+    """
+
+    def __init__(self, states, initial):
+        self.states = tuple(states)
+        self.seconds = [0.0] * len(self.states)
+        self.current = self.states.index(initial)
+        self._since = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set(self, state):
+        now = time.monotonic()
+        index = self.states.index(state)
+        with self._lock:
+            self.seconds[self.current] += now - self._since
+            self.current = index
+            self._since = now
+
+    def totals(self):
+        with self._lock:
+            totals = list(self.seconds)
+            totals[self.current] += time.monotonic() - self._since
+        return totals
+
+
+class Family:
+    """
+    Metrik mit festen Label-Werten. metric_factory erzeugt pro Label-Wert ein
+    Counter/Gauge/Histogram-Objekt.
+    """
+
+    def __init__(self, name, help_text, kind, label_names=(), label_values=(), metric_factory=Counter):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.label_names = tuple(label_names)
+        self._factory = metric_factory
+        self.children = {}
+        if not self.label_names:
+            self.children[()] = metric_factory()
+        for values in label_values:
+            self.add(values)
+        if self.label_names:
+            self.add((OTHER,) * len(self.label_names))
+
+    def add(self, values):
+        """
+        Legt einen Label-Wert an (nur beim Start aufrufen).
+        """
+        values = tuple(values) if isinstance(values, (tuple, list)) else (values,)
+        if values not in self.children:
+            self.children[values] = self._factory()
+        return self.children[values]
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[(OTHER,) * len(self.label_names)]
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self.children.items():
+            lines.extend(child.render(self.name, _labels(self.label_names, values)))
+        return lines
+
+
+class StateFamily:
+    """
+    Zeit pro Zustand als Counter (Sekunden), aus einem oder mehreren StateTimern.
+    """
+
+    def __init__(self, name, help_text, label_name, timers, state_label='state'):
+        self.name = name
+        self.help = help_text
+        self.label_name = label_name
+        self.state_label = state_label
+        self.timers = timers  # {Label-Wert: StateTimer} oder {None: StateTimer}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, timer in self.timers.items():
+            for state, seconds in zip(timer.states, timer.totals()):
+                labels = f'{self.state_label}="{state}"'
+                if key is not None:
+                    labels = f'{self.label_name}="{key}",' + labels
+                lines.append(f"{self.name}{{{labels}}} {seconds}")
+        return lines
+
+
+class Callback:
+    """
+    Wert wird erst beim Abruf von /metrics ermittelt.
+    """
+
+    def __init__(self, name, help_text, kind, func):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.func = func
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}",
+                f"{self.name} {self.func()}"]
+
+
+class Registry:
+    def __init__(self):
+        self.families = []
+
+    def register(self, family):
+        self.families.append(family)
+        return family
+
+    def render(self):
+        lines = []
+        for family in self.families:
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedPi:
+    """
+    Umhüllt ein pigpio.pi()-Objekt und misst Anzahl und Dauer jedes Befehls.
+    write_hooks: {GPIO: Funktion(Pegel)}, z.B. um Relaiszustände mitzuschreiben.
+    Läuft eine Aufzeichnung (tracer.active), wird jeder Befehl als Span erfasst.
+    """
+
+    COMMANDS = ('set_mode', 'write', 'read', 'hardware_PWM', 'set_PWM_frequency', 'set_PWM_dutycycle',
+                'gpio_trigger', 'set_watchdog', 'get_current_tick', 'wave_clear', 'wave_add_generic',
+                'wave_create', 'wave_send_once', 'wave_tx_busy', 'wave_tx_stop', 'wave_delete')
+
+    def __init__(self, pi, latency_family, write_hooks=None, tracer=None):
+        self._pi = pi
+        self._write_hooks = write_hooks or {}
+        self._tracer = tracer
+        for name in self.COMMANDS:
+            setattr(self, name, self._wrap(name, getattr(pi, name), latency_family.add(name)))
+
+    def _wrap(self, name, func, histogram):
+        observe = histogram.observe
+        clock = time.perf_counter_ns
+        hooks = self._write_hooks
+        tracer = self._tracer
+
+        def timed(*args, **kwargs):
+            start = clock()
+            result = func(*args, **kwargs)
+            end = clock()
+            observe((end - start) / 1e9)
+            if tracer is not None and tracer.active:
+                tracer.complete(name, 'pigpio', start, end, args)
+            return result
+
+        if name != 'write':
+            return timed
+
+        def write(gpio, level):
+            result = timed(gpio, level)
+            hook = hooks.get(gpio)
+            if hook is not None:
+                hook(level)
+            return result
+        return write
+
+    def __getattr__(self, name):
+        return getattr(self._pi, name)
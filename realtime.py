@@ -0,0 +1,64 @@
+"""
+Echtzeit-Einstellungen für den Wiedergabe-Thread (nur Linux).
+
+SCHED_FIFO und CPU-Affinität gelten für den aufrufenden Thread, mlockall für
+den ganzen Prozess. Jede Einstellung wird einzeln versucht; was fehlschlägt
+(z.B. fehlende CAP_SYS_NICE / RLIMIT_MEMLOCK), landet mit Grund im Ergebnis.
+Für beste Ergebnisse die CPU per isolcpus=<cpu> vom Scheduler freihalten.
+"""
+import ctypes
+import ctypes.util
+import os
+import threading
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+_memory_locked = False
+
+
+def _lock_memory():
+    global _memory_locked
+    if _memory_locked:
+        return True, None
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        return False, os.strerror(ctypes.get_errno())
+    _memory_locked = True
+    return True, None
+
+
+def apply(priority, cpu):
+    """
+    Setzt SCHED_FIFO mit priority, pinnt den aufrufenden Thread auf cpu und
+    sperrt den Speicher. Liefert ein dict {Einstellung: True | Fehlertext}.
+    """
+    status = {}
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        status['sched_fifo'] = True
+    except (AttributeError, OSError) as e:
+        status['sched_fifo'] = str(e)
+    try:
+        os.sched_setaffinity(0, {cpu})
+        status['affinity'] = True
+    except (AttributeError, OSError, ValueError) as e:
+        status['affinity'] = str(e)
+    try:
+        ok, error = _lock_memory()
+        status['mlock'] = True if ok else error
+    except (AttributeError, OSError) as e:
+        status['mlock'] = str(e)
+    return status
+
+
+def probe(priority, cpu):
+    """
+    Prüft in einem kurzlebigen Thread, ob sich die Einstellungen setzen lassen.
+    """
+    result = {}
+    t = threading.Thread(target=lambda: result.update(apply(priority, cpu)))
+    t.start()
+    t.join()
+    return result
+
@@ -0,0 +1,69 @@
+"""
+Gemeinsame Grundlage für Aufzeichnungen in vorab angelegte Listen
+(tracing.TraceRecorder, session.SessionRecorder).
+
+Jede Spalte ist eine Liste fester Länge. Ein Schreiber holt sich mit _claim()
+einen Zeilenindex und füllt seine Zeile ohne Sperre; next() auf einem
+range-Iterator ist unter dem GIL atomar. Wie viele Zeilen vergeben wurden,
+ergibt sich aus dem Iterator selbst (operator.length_hint), nicht aus einem
+Zähler, den jeder Schreiber setzt: sonst könnte ein später fertig werdender
+kleinerer Index die Anzahl wieder senken.
+"""
+import operator
+
+_SLOTS = 1 << 62
+
+
+class BufferedRecorder:
+    DEFAULT_CAPACITY = 100_000
+    COLUMNS = {}  # Spaltenname -> Startwert, als Liste self._<Name>
+
+    def __init__(self):
+        # Puffer werden erst beim ersten start() angelegt
+        self.active = False
+        self.capacity = 0
+        self._allocate(0)
+
+    def _allocate(self, capacity):
+        if capacity != self.capacity or not capacity:
+            self.capacity = capacity
+            for name, default in self.COLUMNS.items():
+                setattr(self, f"_{name}", [default] * capacity)
+        self._slots = iter(range(_SLOTS))
+        self._claimed = None
+
+    def start(self, capacity=None):
+        """
+        Startet eine neue Aufzeichnung (verwirft die vorherige).
+        """
+        self.active = False
+        self._allocate(capacity or self.capacity or self.DEFAULT_CAPACITY)
+        self.active = True
+
+    def stop(self):
+        # Anzahl festhalten; Schreiber, die danach noch einen Index holen, zählen nicht mehr
+        self.active = False
+        self._claimed = self._claimed_now()
+
+    def _claim(self):
+        """
+        Index der nächsten freien Zeile, None wenn der Puffer voll ist.
+        """
+        i = next(self._slots)
+        return i if i < self.capacity else None
+
+    def _claimed_now(self):
+        return _SLOTS - operator.length_hint(self._slots)
+
+    @property
+    def count(self):
+        claimed = self._claimed_now() if self._claimed is None else self._claimed
+        return min(claimed, self.capacity)
+
+    @property
+    def dropped(self):
+        claimed = self._claimed_now() if self._claimed is None else self._claimed
+        return max(claimed - self.capacity, 0)
+
+    def summary(self):
+        return {'events': self.count, 'dropped': self.dropped, 'capacity': self.capacity}
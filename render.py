@@ -0,0 +1,243 @@
+"""
+Vorschaubilder eines Songs: Piano-Roll mit der tatsächlichen Pulsfolge.
+
+Oben die gefeuerten Noten (Piano-Roll) mit geblockten Noten als Marker,
+in der Mitte die effektive t_ON pro Puls, unten der Duty Cycle pro
+Analysefenster mit dem Budget als Linie. Lange Songs werden vor dem
+Zeichnen auf die Bildbreite reduziert (Belegungsraster bzw. Min/Max pro
+Pixelspalte), damit die Renderzeit nicht mit der Event-Zahl wächst.
+
+Fertige Bilder liegen in CACHE_DIR, Schlüssel ist der Hash des Songs plus
+alle Render-Einstellungen. Der Cache hält höchstens CACHE_MAX_FILES Bilder,
+die am längsten nicht abgerufenen werden zuerst gelöscht. Gerendert wird ausschließlich in einem eigenen
+Worker-Prozess (PreviewRenderer), nie im Web- oder Wiedergabe-Prozess.
+"""
+import concurrent.futures
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+
+import numpy as np
+
+import songpack
+import songs
+
+RENDER_VERSION = 1  # bei Änderungen am Layout erhöhen, macht alte Cache-Einträge ungültig
+CACHE_DIR = './data/render-cache/'
+CACHE_MAX_FILES = 200  # ca. 70 kB pro Bild in Standardgröße
+RENDER_TIMEOUT_S = 30.0
+DEFAULT_WIDTH = 1200
+DEFAULT_HEIGHT = 600
+MAX_SIZE = 4000
+DPI = 100
+
+
+@functools.lru_cache(maxsize=512)
+def _hash_cached(filepath, version):
+    name = songpack.lookup(filepath)
+    if name is not None:
+        return hashlib.sha256(songpack.PACK.data(name)).hexdigest()
+    with open(filepath, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def song_hash(filepath):
+    return _hash_cached(os.path.abspath(filepath), songs.song_version(filepath))
+
+
+def cache_key(digest, settings):
+    """
+    Schlüssel aus Song-Hash und Einstellungen (dict mit JSON-fähigen Werten).
+    """
+    blob = json.dumps({'song': digest, 'version': RENDER_VERSION, **settings}, sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()[:32]
+
+
+def bin_minmax(t_ms, values, total_ms, bins):
+    """
+    Min/Max von values pro Zeitspalte. t_ms muss aufsteigend sortiert sein.
+    Liefert (Spalten-Index, Minimum, Maximum) nur für belegte Spalten.
+    """
+    if not len(t_ms):
+        empty = np.empty(0)
+        return empty.astype(np.int64), empty, empty
+    column = np.minimum(np.asarray(t_ms, dtype=np.int64) * bins // max(total_ms, 1), bins - 1)
+    starts = np.flatnonzero(np.diff(column, prepend=-1))
+    values = np.asarray(values)
+    return column[starts], np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts)
+
+
+def roll_raster(start_ms, end_ms, notes, total_ms, bins):
+    """
+    Belegung Note x Zeitspalte (128 x bins) für die Piano-Roll: +1 am Anfang,
+    -1 hinter dem Ende jeder Note, dann kumulative Summe entlang der Zeit.
+    """
+    grid = np.zeros((128, bins + 1), dtype=np.int32)
+    scale = max(total_ms, 1)
+    first = np.minimum(np.asarray(start_ms, dtype=np.int64) * bins // scale, bins - 1)
+    last = np.minimum(np.asarray(end_ms, dtype=np.int64) * bins // scale, bins - 1)
+    np.add.at(grid, (notes, first), 1)
+    np.add.at(grid, (notes, np.maximum(last, first) + 1), -1)
+    return np.cumsum(grid[:, :bins], axis=1) > 0
+
+
+def render_song(filepath, out_path, t_on_us, block_time_us, max_duty_percent, auto_fit=False, transpose=0,
+                width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, window_ms=songs.ANALYSIS_WINDOW_MS):
+    """
+    Rendert die Vorschau als PNG nach out_path (atomar). Läuft im Worker-Prozess.
+    transpose wirkt auf t_ON und Duty, die Piano-Roll zeigt die Noten der Datei.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    events = songs.load_events(filepath)
+    t_on = t_on_us
+    if auto_fit:
+        events, t_on, _ = songs.fit_to_budget(events, t_on_us, block_time_us, max_duty_percent, window_ms,
+                                              transpose=transpose)
+    analysis = songs.analyze_events(events, t_on, block_time_us, max_duty_percent, window_ms, transpose)
+    tl = analysis['timeline']
+    total_ms = max(tl['total_ms'], 1)
+    bins = width
+    seconds = total_ms / 1000
+
+    fig, (ax_roll, ax_ton, ax_duty) = plt.subplots(
+        3, 1, sharex=True, figsize=(width / DPI, height / DPI), dpi=DPI,
+        gridspec_kw={'height_ratios': (3, 1, 1)})
+
+    # Piano-Roll auf Notenbereich des Songs beschränkt
+    notes = tl['note']
+    blocked = tl['on_idx'][tl['blocked']]
+    if len(notes):
+        all_notes = events['note'][tl['on_idx']]
+        lo, hi = max(int(all_notes.min()) - 1, 0), min(int(all_notes.max()) + 2, 128)
+        raster = roll_raster(tl['start_ms'], tl['end_ms'], notes, total_ms, bins)[lo:hi]
+        ax_roll.imshow(raster, aspect='auto', origin='lower', interpolation='nearest', cmap='Blues',
+                       vmin=0, vmax=1.5, extent=(0, seconds, lo - 0.5, hi - 0.5))
+        if len(blocked):
+            col, b_lo, b_hi = bin_minmax(tl['t_ms'][blocked], events['note'][blocked], total_ms, bins)
+            x = (col + 0.5) * seconds / bins
+            ax_roll.vlines(x, b_lo - 0.4, b_hi + 0.4, colors='red', linewidth=1)
+            ax_roll.plot(x, b_lo, 'x', color='red', markersize=3, label=f"geblockt ({len(blocked)})")
+            ax_roll.legend(loc='upper right', fontsize='small')
+    ax_roll.set_ylabel('MIDI-Note')
+
+    # Pulsfolge: effektive t_ON pro gefeuerter Note, Min/Max pro Pixelspalte
+    col, t_lo, t_hi = bin_minmax(tl['start_ms'], tl['effective_t_on_us'], total_ms, bins)
+    x = (col + 0.5) * seconds / bins
+    ax_ton.vlines(x, 0, t_hi, colors='tab:orange', linewidth=1, alpha=0.3)
+    ax_ton.vlines(x, t_lo, t_hi, colors='tab:orange', linewidth=2)
+    ax_ton.plot(x, t_hi, '.', color='tab:orange', markersize=2)
+    ax_ton.set_ylim(0, max(float(t_hi.max()) if len(t_hi) else 0, t_on_us) * 1.1 or 1)
+    ax_ton.set_ylabel('t_ON (µs)')
+
+    # Duty pro Fenster; mehr Fenster als Spalten werden zu Min/Max-Bändern
+    duty = analysis['duty'] * 100
+    window_t = np.arange(len(duty), dtype=np.int64) * window_ms
+    if len(duty) > bins:
+        col, d_lo, d_hi = bin_minmax(window_t, duty, total_ms, bins)
+        x = (col + 0.5) * seconds / bins
+        ax_duty.fill_between(x, d_lo, d_hi, step='mid', color='tab:green', linewidth=0)
+        ax_duty.plot(x, d_hi, color='tab:green', linewidth=0.5, drawstyle='steps-mid')
+    else:
+        ax_duty.step(window_t / 1000, duty, where='post', color='tab:green', linewidth=0.8)
+    ax_duty.axhline(max_duty_percent, color='red', linestyle='--', linewidth=0.8)
+    ax_duty.set_ylim(bottom=0)
+    ax_duty.set_ylabel('Duty (%)')
+    ax_duty.set_xlabel('Zeit (s)')
+    ax_duty.set_xlim(0, seconds)
+
+    summary = analysis['summary']
+    ax_roll.set_title(f"{os.path.basename(filepath)} — t_ON {t_on_us} µs, {summary['notes']} Noten, "
+                      f"max. Duty {summary['max_duty_percent']:.2f} %", fontsize='medium')
+    fig.tight_layout()
+
+    tmp = f"{out_path}.{os.getpid()}.tmp"
+    fig.savefig(tmp, format='png')
+    plt.close(fig)
+    os.replace(tmp, out_path)
+    return out_path
+
+
+class PreviewRenderer:
+    """
+    Liefert Vorschaubilder aus dem Cache oder rendert sie in einem Worker-Prozess.
+    Gleichzeitige Anfragen für dasselbe Bild warten auf denselben Auftrag.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, workers=1, max_files=CACHE_MAX_FILES):
+        # Der Worker liest Songs aus demselben Pack wie der aufrufende Prozess
+        self._pack = (songpack.PACK.path, songpack.PACK.source_dir) if songpack.PACK is not None else None
+        self.cache_dir = cache_dir
+        self.max_files = max_files
+        self.workers = workers
+        self._pool = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        # spawn: der Worker erbt keine Threads/pigpio-Verbindung des Web-Prozesses
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=songpack.use if self._pack else None, initargs=self._pack or ())
+        return self._pool
+
+    def preview(self, filepath, timeout=RENDER_TIMEOUT_S, **settings):
+        """
+        Pfad zum PNG für filepath mit den Render-Einstellungen (siehe render_song()).
+        Wirft OSError, wenn der Song fehlt, und TimeoutError, wenn das Rendern zu lange dauert.
+        """
+        key = cache_key(song_hash(filepath), settings)
+        path = os.path.join(self.cache_dir, f"{key}.png")
+        if os.path.exists(path):
+            try:
+                os.utime(path)  # zuletzt abgerufen, für _evict()
+            except OSError:
+                pass
+            return path
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                future = self._executor().submit(render_song, filepath, path, **settings)
+                self._pending[key] = future
+                future.add_done_callback(lambda _: self._pending.pop(key, None))
+        try:
+            result = future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            raise TimeoutError(f"Rendern dauert länger als {timeout} s")
+        except concurrent.futures.process.BrokenProcessPool:
+            # Worker abgestürzt: beim nächsten Aufruf neu starten
+            with self._lock:
+                self._pool = None
+            raise RuntimeError("Render-Prozess abgestürzt")
+        self._evict()
+        return result
+
+    def _evict(self):
+        """
+        Löscht die am längsten nicht abgerufenen Bilder über max_files hinaus.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.png'):
+                try:
+                    entries.append((os.stat(os.path.join(self.cache_dir, name)).st_mtime, name))
+                except OSError:
+                    pass
+        entries.sort()
+        for _, name in entries[:max(len(entries) - self.max_files, 0)]:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,150 @@
+"""
+Aufzeichnung und Wiedergabe einer Bedien-Session (Regler, Bursts, Single
+Shots, CW), damit sich ein Lauf von Hand exakt wiederholen lässt.
+
+Die Steuer-Routen in main.py melden jede Änderung am Interrupter-Ausgang an
+RECORDER. Aufgezeichnet wird in vorab angelegte Listen mit Zeitstempeln
+aus time.perf_counter_ns(); solange keine Aufnahme läuft, kostet ein Aufruf
+nur die Abfrage von RECORDER.active.
+
+Dateiformat wie bei Songs ohne Kopf, ein Event '<IBBII' pro Änderung:
+dt in ns seit dem vorherigen Event, Typ, GPIO, zwei Werte (siehe unten).
+Lücken über MAX_DT_NS werden mit wirkungslosen Füll-Events (Typ 0)
+überbrückt. Abgespielt wird mit main.play_session() im selben Wiedergabe-
+Thread bzw. Engine-Prozess wie Songs.
+
+Kommt ohne NumPy aus, solange nur aufgezeichnet wird.
+"""
+import os
+import time
+
+from recorder import BufferedRecorder
+
+FILLER = 0
+PWM = 1  # a = Frequenz (Hz), b = Duty (von 1.000.000), wie hardware_PWM()
+PULSE = 2  # a = t_ON (µs), einzelner Puls wie /single_shot
+LEVEL = 3  # a = Pegel, wie write()
+OFF = 4  # alle Ausgänge aus, wie _stop_all_outputs()
+
+# NumPy-dtype der Events: session_dtype()
+SESSION_FIELDS = [('dt', '<u4'), ('type', 'u1'), ('pin', 'u1'), ('a', '<u4'), ('b', '<u4')]
+MAX_DT_NS = 2 ** 32 - 1
+DEFAULT_CAPACITY = 100_000
+SESSION_DIR = './data/sessions/'
+
+
+class SessionRecorder(BufferedRecorder):
+    DEFAULT_CAPACITY = DEFAULT_CAPACITY
+    COLUMNS = {'t_ns': 0, 'type': 0, 'pin': 0, 'a': 0, 'b': 0}
+
+    def record(self, ev_type, pin, a=0, b=0):
+        """
+        Zeichnet eine Ausgabeänderung auf. Ist der Puffer voll, wird nur gezählt.
+        """
+        if not self.active:
+            return
+        t_ns = time.perf_counter_ns()
+        i = self._claim()
+        if i is None:
+            return
+        self._t_ns[i] = t_ns
+        self._type[i] = ev_type
+        self._pin[i] = pin
+        self._a[i] = a
+        self._b[i] = b
+
+    def events(self):
+        """
+        Aufnahme als Event-Array (session_dtype()), das erste Event bei dt = 0.
+        """
+        import numpy as np
+        count = self.count
+        t_ns = np.array(self._t_ns[:count], dtype=np.int64)
+        order = np.argsort(t_ns, kind='stable')  # Threads können sich überholen
+        columns = [np.array(c[:count])[order] for c in (self._type, self._pin, self._a, self._b)]
+        return pack_events(t_ns[order] - (t_ns[order[0]] if count else 0), *columns)
+
+    def summary(self):
+        return {'recording': self.active, **super().summary()}
+
+
+def pack_events(t_ns, types, pins, a, b):
+    """
+    Baut aus absoluten Zeitpunkten (ns) ein Event-Array, mit Füll-Events für lange Pausen.
+    """
+    import numpy as np
+    t_ns = np.asarray(t_ns, dtype=np.int64)
+    dt = np.diff(t_ns, prepend=0)
+    fillers = np.maximum((dt - 1) // MAX_DT_NS, 0)  # Füll-Events vor jedem Event
+    events = np.zeros(len(t_ns) + int(fillers.sum()), dtype=session_dtype())
+    pos = np.arange(len(t_ns)) + np.cumsum(fillers)
+    events['dt'][pos] = dt - fillers * MAX_DT_NS
+    filler_pos = np.setdiff1d(np.arange(len(events)), pos)
+    events['dt'][filler_pos] = MAX_DT_NS
+    events['type'][pos] = types
+    events['pin'][pos] = pins
+    events['a'][pos] = a
+    events['b'][pos] = b
+    return events
+
+
+def session_dtype():
+    import numpy as np
+    return np.dtype(SESSION_FIELDS)
+
+
+def session_path(name, directory=SESSION_DIR):
+    """
+    Pfad einer Session; nur Buchstaben, Ziffern, '-' und '_' im Namen.
+    """
+    if not name or not name.replace('-', '').replace('_', '').isalnum():
+        raise ValueError(f"Ungültiger Session-Name: {name!r}")
+    return os.path.join(directory, name)
+
+
+def save(events, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(events.tobytes())
+    os.replace(tmp, path)
+
+
+def load(path):
+    """
+    Liest eine Session (unvollständiges letztes Event wird ignoriert).
+    """
+    import numpy as np
+    dtype = session_dtype()
+    with open(path, 'rb') as f:
+        data = f.read()
+    return np.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize)
+
+
+def validate(events, pins, max_t_on_us):
+    """
+    Prüft eine Session vor der Wiedergabe gegen die aktuellen Grenzen
+    (GPIO, t_ON pro Puls bzw. PWM-Periode). Wirft ValueError.
+    """
+    import numpy as np
+    known = np.isin(events['type'], (FILLER, PWM, PULSE, LEVEL, OFF))
+    if not known.all():
+        raise ValueError(f"Unbekannter Event-Typ {int(events['type'][~known][0])}")
+    outputs = np.isin(events['type'], (PWM, PULSE, LEVEL))
+    if not np.isin(events['pin'][outputs], pins).all():
+        raise ValueError("Session schaltet einen GPIO, der kein Interrupter-Ausgang ist")
+    pwm = (events['type'] == PWM) & (events['a'] > 0)
+    # Duty ppm / Hz = µs; die Routen runden die Frequenz ab, angefragt war also mindestens Duty / (Hz + 1)
+    t_on_us = events['b'][pwm] / (events['a'][pwm].astype(np.float64) + 1)
+    if (t_on_us > max_t_on_us).any() or (events['a'][events['type'] == PULSE] > max_t_on_us).any():
+        raise ValueError(f"Session überschreitet t_ON von {max_t_on_us} µs")
+
+
+def list_sessions(directory=SESSION_DIR):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))
+                  and not f.endswith('.tmp'))
+
+
+RECORDER = SessionRecorder()
@@ -0,0 +1,117 @@
+"""
+Simuliertes pigpio-Backend für Entwicklung und Benchmarks ohne Raspberry Pi.
+
+Bildet die von main.py genutzte Teilmenge der pigpio-API nach und merkt sich
+Pegel, PWM-Einstellungen und (optional) jede Ausgabeänderung mit Zeitstempel.
+Aktivierung über die Umgebungsvariable INTERRUPTER_BACKEND=sim.
+"""
+import collections
+import os
+import threading
+import time
+
+INPUT = 0
+OUTPUT = 1
+
+pulse = collections.namedtuple('pulse', ['gpio_on', 'gpio_off', 'delay'])
+
+# Simulierte Umlaufzeit eines Befehls über den pigpiod-Socket (µs), 0 = keine.
+# Hin- und Rückweg dauern je die Hälfte, ausgeführt wird dazwischen.
+COMMAND_LATENCY_US = int(os.environ.get('INTERRUPTER_SIM_LATENCY_US', 0))
+
+
+def _spin(us):
+    end = time.perf_counter_ns() + int(us * 1000)
+    while time.perf_counter_ns() < end:
+        pass
+
+
+class pi:
+    """
+    Ersatz für pigpio.pi(). Ausgabeänderungen landen in self.changes als
+    (perf_counter_ns, Befehl, GPIO, Wert1, Wert2), sofern record_changes gesetzt ist.
+    """
+
+    def __init__(self, host=None, port=None, record_changes=False):
+        self.connected = True
+        self.modes = {}
+        self.levels = {}
+        self.pwm = {}
+        self.record_changes = record_changes
+        self.changes = []
+        self._lock = threading.Lock()
+        self._wave = []
+        self._start_ns = time.perf_counter_ns()
+        self._executed_ns = self._start_ns  # Ausführungszeitpunkt des letzten Befehls
+
+    def _command(self, cmd, gpio=0, a=0, b=0, output=True):
+        if COMMAND_LATENCY_US:
+            _spin(COMMAND_LATENCY_US / 2)
+        executed_ns = self._executed_ns = time.perf_counter_ns()
+        if output and self.record_changes:
+            with self._lock:
+                self.changes.append((executed_ns, cmd, gpio, a, b))
+        if COMMAND_LATENCY_US:
+            _spin(COMMAND_LATENCY_US / 2)
+        return 0
+
+    def set_mode(self, gpio, mode):
+        self.modes[gpio] = mode
+        return self._command('set_mode', gpio, mode, output=False)
+
+    def write(self, gpio, level):
+        self.levels[gpio] = level
+        return self._command('write', gpio, level)
+
+    def read(self, gpio):
+        self._command('read', gpio, output=False)
+        return self.levels.get(gpio, 0)
+
+    def hardware_PWM(self, gpio, frequency, dutycycle):
+        self.pwm[gpio] = (frequency, dutycycle)
+        return self._command('hardware_PWM', gpio, frequency, dutycycle)
+
+    def set_PWM_frequency(self, gpio, frequency):
+        return self._command('set_PWM_frequency', gpio, frequency)
+
+    def set_PWM_dutycycle(self, gpio, dutycycle):
+        return self._command('set_PWM_dutycycle', gpio, dutycycle)
+
+    def gpio_trigger(self, gpio, pulse_len=10, level=1):
+        return self._command('gpio_trigger', gpio, pulse_len, level)
+
+    def set_watchdog(self, gpio, wdog_timeout):
+        return self._command('set_watchdog', gpio, wdog_timeout, output=False)
+
+    def get_current_tick(self):
+        self._command('get_current_tick', output=False)
+        return ((self._executed_ns - self._start_ns) // 1000) & 0xFFFFFFFF
+
+    def wave_clear(self):
+        self._wave = []
+        return self._command('wave_clear', output=False)
+
+    def wave_add_generic(self, pulses):
+        self._wave.extend(pulses)
+        return self._command('wave_add_generic', output=False)
+
+    def wave_create(self):
+        self._command('wave_create', output=False)
+        return 0
+
+    def wave_send_once(self, wave_id):
+        length = sum(p.delay for p in self._wave)
+        return self._command('wave_send_once', wave_id, length)
+
+    def wave_tx_busy(self):
+        self._command('wave_tx_busy', output=False)
+        return 0
+
+    def wave_tx_stop(self):
+        return self._command('wave_tx_stop')
+
+    def wave_delete(self, wave_id):
+        return self._command('wave_delete', wave_id, output=False)
+
+    def stop(self):
+        self.connected = False
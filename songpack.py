@@ -0,0 +1,155 @@
+"""
+Song-Bibliothek als eine Datei (Pack), per mmap ohne Kopien gelesen.
+
+Aufbau (Little Endian):
+- Header '<4sHHI': Magic 'DRSP', Version, Größe eines Tabelleneintrags, Anzahl Songs
+- Tabelle, ein Eintrag '<96sQII' pro Song: Name (UTF-8, mit Nullen aufgefüllt),
+  Offset der Events in der Datei, Anzahl Events, CRC32 der Event-Bytes
+- Event-Arrays im Song-Format ('<HBBB' je Event), jeweils auf ALIGN Bytes ausgerichtet
+
+Ist ein Pack aktiv (use()), liefert songs.load_events() Songs aus dem
+Verzeichnis source_dir direkt als Sicht auf das mmap; Auflistung und
+Existenzprüfung kommen aus der Tabelle, ohne das Verzeichnis anzufassen.
+Das Pack wird mit tools/build_song_pack.py aus data/midi-files erzeugt und
+muss danach neu gebaut werden, wenn sich die Bibliothek ändert. Songs, die
+nicht im Pack stehen, werden weiter als einzelne Datei gelesen.
+
+Kommt ohne NumPy aus, solange keine Events gelesen werden.
+"""
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+MAGIC = b'DRSP'
+VERSION = 1
+ALIGN = 64
+EVENT_SIZE = 5
+NAME_BYTES = 96
+
+_HEADER = struct.Struct('<4sHHI')
+_ENTRY = struct.Struct(f'<{NAME_BYTES}sQII')
+
+logger = logging.getLogger("MIDI")
+
+PACK = None  # aktives SongPack (use())
+
+
+def _aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+class SongPack:
+    """
+    Lesender Zugriff auf ein Pack. Die Prüfsumme eines Songs wird beim ersten
+    Zugriff über die gemappten Bytes geprüft.
+    """
+
+    def __init__(self, path, source_dir=None):
+        self.path = path
+        self.source_dir = os.path.abspath(source_dir) if source_dir else None
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, entry_size, count = _HEADER.unpack_from(self._mm, 0)
+        if (magic, version, entry_size) != (MAGIC, VERSION, _ENTRY.size):
+            raise ValueError(f"{path}: kein Song-Pack (Version {VERSION})")
+        self.entries = {}
+        for i in range(count):
+            name, offset, events, crc = _ENTRY.unpack_from(self._mm, _HEADER.size + i * _ENTRY.size)
+            if offset + events * EVENT_SIZE > len(self._mm):
+                raise ValueError(f"{path}: Eintrag {i} liegt hinter dem Dateiende")
+            self.entries[name.rstrip(b'\0').decode()] = (offset, events, crc)
+        self._verified = set()
+
+    def names(self):
+        return list(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def data(self, name):
+        """
+        Event-Bytes eines Songs als memoryview auf das mmap. KeyError, wenn
+        der Song fehlt, ValueError bei falscher Prüfsumme.
+        """
+        offset, events, crc = self.entries[name]
+        view = memoryview(self._mm)[offset:offset + events * EVENT_SIZE]
+        if name not in self._verified:
+            if zlib.crc32(view) != crc:
+                raise ValueError(f"{self.path}: Prüfsumme von {name} stimmt nicht")
+            self._verified.add(name)
+        return view
+
+    def events(self, name):
+        """
+        Events als schreibgeschütztes NumPy-Array (songs.EVENT_DTYPE) ohne Kopie.
+        """
+        import numpy as np
+        import songs
+        return np.frombuffer(self.data(name), dtype=songs.EVENT_DTYPE)
+
+    def lookup(self, filepath):
+        """
+        Name im Pack für einen Pfad in source_dir, sonst None.
+        """
+        directory, name = os.path.split(filepath)
+        if name in self.entries and os.path.abspath(directory) == self.source_dir:
+            return name
+        return None
+
+
+def build(source_dir, out_path):
+    """
+    Schreibt alle Dateien aus source_dir (sortiert) als Pack nach out_path
+    (atomar). Ein unvollständiges letztes Event wird wie beim Laden verworfen.
+    Liefert die Anzahl Songs.
+    """
+    names = sorted(f for f in os.listdir(source_dir) if os.path.isfile(os.path.join(source_dir, f)))
+    blobs = []
+    for name in names:
+        if len(name.encode()) > NAME_BYTES:
+            raise ValueError(f"Name zu lang für das Pack: {name}")
+        with open(os.path.join(source_dir, name), 'rb') as f:
+            data = f.read()
+        blobs.append(data[:len(data) // EVENT_SIZE * EVENT_SIZE])
+
+    offset = _aligned(_HEADER.size + len(names) * _ENTRY.size)
+    table = [_HEADER.pack(MAGIC, VERSION, _ENTRY.size, len(names))]
+    offsets = []
+    for name, blob in zip(names, blobs):
+        offsets.append(offset)
+        table.append(_ENTRY.pack(name.encode(), offset, len(blob) // EVENT_SIZE, zlib.crc32(blob)))
+        offset = _aligned(offset + len(blob))
+
+    tmp = f"{out_path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(b''.join(table))
+        for start, blob in zip(offsets, blobs):
+            f.write(bytes(start - f.tell()))
+            f.write(blob)
+    os.replace(tmp, out_path)
+    return len(names)
+
+
+def use(path, source_dir):
+    """
+    Aktiviert das Pack unter path für Songs aus source_dir. Fehlt die Datei
+    oder ist sie ungültig, bleibt es bei einzelnen Dateien (Rückgabe None).
+    """
+    global PACK
+    try:
+        PACK = SongPack(path, source_dir)
+    except FileNotFoundError:
+        PACK = None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Song-Pack wird ignoriert: {e}")
+        PACK = None
+    return PACK
+
+
+def lookup(filepath):
+    """
+    Name im aktiven Pack für filepath, sonst None.
+    """
+    return PACK.lookup(filepath) if PACK is not None else None
@@ -0,0 +1,459 @@
+"""
+Song-Format und vektorisierte Vorab-Analyse.
+
+Ein Song ist eine Folge von 5-Byte-Events im Format '<HBBB'
+(dt in ms seit dem vorherigen Event, Event-Typ, Note, Velocity).
+Die Analyse bildet das Verhalten von play_midi_file() nach
+(monophon, NOTE_BLOCK_TIME_US-Sperre, MIDI_MAX_T_ON-Begrenzung),
+ohne die Events einzeln in Python abzuarbeiten.
+"""
+import functools
+import os
+
+import numpy as np
+
+import songpack
+
+NOTE_ON = 0x90
+NOTE_OFF = 0x80
+
+EVENT_DTYPE = np.dtype([('dt', '<u2'), ('type', 'u1'), ('note', 'u1'), ('vel', 'u1')])
+MAX_DT_MS = np.iinfo(np.uint16).max
+
+# Frequenz- und Periodentabelle für alle 128 MIDI-Noten
+NOTE_FREQ = 440.0 * 2.0 ** ((np.arange(128) - 69) / 12.0)
+# pigpio bekommt die Frequenz als int übergeben
+NOTE_FREQ_INT = NOTE_FREQ.astype(np.int64)
+
+ANALYSIS_WINDOW_MS = 100  # Fensterbreite für Duty/Energie/Notendichte
+MIN_FIT_T_ON = 1  # Untergrenze für t_ON beim automatischen Anpassen (µs)
+
+
+def load_events(filepath):
+    """
+    Liest eine Song-Datei als strukturiertes NumPy-Array (EVENT_DTYPE).
+    Ein unvollständiges letztes Event wird ignoriert, wie beim Abspielen.
+    Steht der Song im aktiven Pack, ist das Ergebnis eine Sicht auf dessen mmap.
+    """
+    name = songpack.lookup(filepath)
+    if name is not None:
+        return songpack.PACK.events(name)
+    with open(filepath, 'rb') as f:
+        return parse_events(f.read())
+
+
+def parse_events(data):
+    """
+    Event-Array aus Bytes im Song-Format (ohne Kopie, unvollständiges Ende ignoriert).
+    """
+    return np.frombuffer(data, dtype=EVENT_DTYPE, count=len(data) // EVENT_DTYPE.itemsize)
+
+
+def pack_events(t_ms, types, notes, vels):
+    """
+    Baut aus absoluten Zeitpunkten (ms) wieder ein Event-Array.
+    Lücken > MAX_DT_MS werden mit wirkungslosen Füll-Events (Typ 0) überbrückt.
+    """
+    t_ms = np.asarray(t_ms, dtype=np.int64)
+    dt = np.diff(t_ms, prepend=0)
+    if len(dt) and dt.max() > MAX_DT_MS:
+        rows = []
+        for d, ev_type, note, vel in zip(dt.tolist(), types, notes, vels):
+            while d > MAX_DT_MS:
+                rows.append((MAX_DT_MS, 0, 0, 0))
+                d -= MAX_DT_MS
+            rows.append((d, ev_type, note, vel))
+        return np.array(rows, dtype=EVENT_DTYPE)
+    events = np.empty(len(t_ms), dtype=EVENT_DTYPE)
+    events['dt'] = dt
+    events['type'] = types
+    events['note'] = notes
+    events['vel'] = vels
+    return events
+
+
+def note_freq(notes, transpose=0):
+    """
+    Frequenz der Noten um transpose Halbtöne verschoben, wie
+    midi_note_to_frequency(note + MIDI_TRANSPOSE). Ohne Transponierung aus NOTE_FREQ.
+    """
+    if not transpose:
+        return NOTE_FREQ[notes]
+    return 440.0 * 2.0 ** ((np.asarray(notes, dtype=np.float64) + transpose - 69) / 12.0)
+
+
+def note_duty(notes, t_on_us, transpose=0):
+    """
+    Duty Cycle (von 1.000.000) wie in calculate_max_duty_cycle(), vektorisiert.
+    """
+    duty = (np.asarray(t_on_us, dtype=np.float64) / 1_000_000.0) * note_freq(notes, transpose) * 1_000_000
+    return np.minimum(duty.astype(np.int64), 1_000_000)
+
+
+def note_timeline(events, t_on_us, block_time_us, transpose=0):
+    """
+    Rekonstruiert, welche NOTE_ONs tatsächlich feuern und wie lange sie klingen.
+
+    t_on_us ist ein Skalar oder ein Array mit einem Wert pro Event. transpose
+    (Halbtöne) geht nur in Frequenz und Duty ein, 'note' bleibt unverändert.
+    Liefert ein dict mit Arrays pro NOTE_ON-Event (Index, Start/Ende in ms,
+    Note, geblockt) und pro gefeuerter Note (t_ON, Duty).
+    """
+    types = events['type']
+    t_ms = np.cumsum(events['dt'], dtype=np.int64)
+    total_ms = int(t_ms[-1]) if len(t_ms) else 0
+
+    on_idx = np.flatnonzero(types == NOTE_ON)
+    on_t = t_ms[on_idx]
+
+    # Sperrzeit: eine Note wird geblockt, wenn die letzte *gefeuerte* Note
+    # weniger als block_time_us zurückliegt. Nur Noten mit kleinem Abstand zur
+    # Vorgängerin können betroffen sein, alle anderen feuern sicher.
+    blocked = np.zeros(len(on_idx), dtype=bool)
+    # Die erste Note hat keine Vorgängerin und feuert immer
+    gap_us = np.diff(on_t) * 1000
+    for i in (np.flatnonzero(gap_us < block_time_us) + 1).tolist():
+        j = i - 1
+        while j >= 0 and blocked[j]:
+            j -= 1
+        if j >= 0 and (on_t[i] - on_t[j]) * 1000 < block_time_us:
+            blocked[i] = True
+
+    fired_idx = on_idx[~blocked]
+    fired_t = t_ms[fired_idx]
+    fired_note = events['note'][fired_idx].astype(np.int64)
+
+    # Ende einer Note: ihr erstes NOTE_OFF vor der nächsten gefeuerten Note,
+    # sonst die nächste gefeuerte Note bzw. das Song-Ende.
+    n = len(events)
+    off_idx = np.flatnonzero(types == NOTE_OFF)
+    off_key = np.sort(events['note'][off_idx].astype(np.int64) * n + off_idx)
+    next_fired = np.append(fired_idx[1:], n)
+    pos = np.searchsorted(off_key, fired_note * n + fired_idx, side='right')
+    cand = off_key[np.minimum(pos, len(off_key) - 1)] if len(off_key) else np.zeros(len(pos), np.int64)
+    has_off = (pos < len(off_key)) & (cand // n == fired_note) & (cand % n < next_fired)
+    end_idx = np.where(has_off, cand % n, np.minimum(next_fired, n - 1))
+    fired_end = np.where(has_off | (next_fired < n), t_ms[end_idx], total_ms)
+
+    if np.ndim(t_on_us) == 0:
+        fired_t_on = np.full(len(fired_idx), t_on_us, dtype=np.int64)
+    else:
+        fired_t_on = np.asarray(t_on_us, dtype=np.int64)[fired_idx]
+    fired_duty = note_duty(fired_note, fired_t_on, transpose)
+    # Effektive Einschaltzeit bei der tatsächlich gesetzten (ganzzahligen) Frequenz
+    freq_int = np.maximum(note_freq(fired_note, transpose).astype(np.int64), 1)
+    effective_t_on = fired_duty / freq_int
+
+    return {
+        't_ms': t_ms,
+        'total_ms': total_ms,
+        'on_idx': on_idx,
+        'blocked': blocked,
+        'fired_idx': fired_idx,
+        'start_ms': fired_t,
+        'end_ms': fired_end,
+        'end_idx': end_idx,
+        'end_by_off': has_off,
+        'note': fired_note,
+        't_on_us': fired_t_on,
+        'freq_int': freq_int,
+        'duty': fired_duty,
+        'effective_t_on_us': effective_t_on,
+    }
+
+
+def _window_rate(timeline, rate, window_ms):
+    """
+    Mittelt eine pro Note konstante (ganzzahlige) Rate über Zeitfenster.
+    Zeitpunkte sind ganzzahlige ms, daher genügt ein 1-ms-Raster; in int64
+    gerechnet bleiben nach dem Ende keine Rundungsreste stehen.
+    """
+    n_windows = max(1, -(-timeline['total_ms'] // window_ms))
+    grid = np.zeros(n_windows * window_ms + 1, dtype=np.int64)
+    np.add.at(grid, timeline['start_ms'], rate)
+    np.add.at(grid, timeline['end_ms'], -rate)
+    per_ms = np.cumsum(grid[:-1])
+    return per_ms.reshape(n_windows, window_ms).mean(axis=1)
+
+
+def analyze_events(events, t_on_us, block_time_us, max_duty_percent, window_ms=ANALYSIS_WINDOW_MS, transpose=0):
+    """
+    Duty, Energie (Einschaltzeit) und Notendichte pro Fenster sowie Anzahl der
+    durch die Sperrzeit verworfenen und durch die Periodendauer begrenzten Noten.
+    """
+    tl = note_timeline(events, t_on_us, block_time_us, transpose)
+    freq_int = tl['freq_int'].astype(np.float64)
+
+    duty = _window_rate(tl, tl['duty'], window_ms) / 1_000_000.0
+    # Einschaltzeit in µs pro Fenster = Duty * Fensterbreite
+    on_time_us = duty * window_ms * 1000
+    n_windows = len(duty)
+    density = np.bincount(tl['t_ms'][tl['on_idx']] // window_ms, minlength=n_windows)[:n_windows]
+    density = density * (1000.0 / window_ms)
+
+    requested = np.asarray(tl['t_on_us'], dtype=np.float64)
+    clamped = int(np.count_nonzero(requested * freq_int > 1_000_000))
+    max_duty = float(duty.max()) if n_windows else 0.0
+    budget = max_duty_percent / 100.0
+
+    return {
+        'timeline': tl,
+        'window_ms': window_ms,
+        'duty': duty,
+        'on_time_us': on_time_us,
+        'density': density,
+        'summary': {
+            'events': int(len(events)),
+            'duration_s': tl['total_ms'] / 1000.0,
+            'notes': int(len(tl['on_idx'])),
+            'blocked_notes': int(tl['blocked'].sum()),
+            'clamped_notes': clamped,
+            'max_duty_percent': max_duty * 100,
+            'mean_duty_percent': float(duty.mean()) * 100 if n_windows else 0.0,
+            'max_notes_per_s': float(density.max()) if n_windows else 0.0,
+            'total_on_time_ms': float(on_time_us.sum()) / 1000,
+            'windows_over_budget': int(np.count_nonzero(duty > budget)),
+            'fits_budget': bool(max_duty <= budget),
+        },
+    }
+
+
+@functools.lru_cache(maxsize=256)
+def _analyze_cached(filepath, version, t_on_us, block_time_us, max_duty_percent, window_ms, transpose):
+    return analyze_events(load_events(filepath), t_on_us, block_time_us, max_duty_percent, window_ms, transpose)
+
+
+def song_version(filepath):
+    """
+    Kennung des aktuellen Inhalts: (mtime, Größe) der Datei bzw. Pack-Pfad und
+    CRC32, wenn der Song aus dem aktiven Pack kommt. OSError, wenn er fehlt.
+    """
+    name = songpack.lookup(filepath)
+    if name is not None:
+        return songpack.PACK.path, songpack.PACK.entries[name][2]
+    st = os.stat(filepath)
+    return st.st_mtime_ns, st.st_size
+
+
+def analyze_song(filepath, t_on_us, block_time_us, max_duty_percent, window_ms=ANALYSIS_WINDOW_MS, transpose=0):
+    """
+    Wie analyze_events(), aber pro Song gecacht (Schlüssel: Pfad, Inhalt laut
+    song_version(), alle Grenzwerte und Transponierung). Ändert sich der Song,
+    wird neu analysiert.
+    """
+    return _analyze_cached(os.path.abspath(filepath), song_version(filepath),
+                           t_on_us, block_time_us, max_duty_percent, window_ms, transpose)
+
+
+def thin_fast_runs(events, min_gap_ms):
+    """
+    Entfernt NOTE_ONs, die weniger als min_gap_ms nach der letzten behaltenen
+    Note kommen, samt ihrem NOTE_OFF. Liefert (neue Events, Anzahl entfernt).
+    """
+    t_ms = np.cumsum(events['dt'], dtype=np.int64)
+    on_idx = np.flatnonzero(events['type'] == NOTE_ON)
+    on_t = t_ms[on_idx]
+    drop_on = np.zeros(len(on_idx), dtype=bool)
+    for i in (np.flatnonzero(np.diff(on_t) < min_gap_ms) + 1).tolist():
+        j = i - 1
+        while j >= 0 and drop_on[j]:
+            j -= 1
+        if j >= 0 and on_t[i] - on_t[j] < min_gap_ms:
+            drop_on[i] = True
+    if not drop_on.any():
+        return events, 0
+
+    keep = np.ones(len(events), dtype=bool)
+    keep[on_idx[drop_on]] = False
+    # Zugehöriges NOTE_OFF: das erste NOTE_OFF derselben Note nach dem NOTE_ON
+    n = len(events)
+    off_idx = np.flatnonzero(events['type'] == NOTE_OFF)
+    off_key = np.sort(events['note'][off_idx].astype(np.int64) * n + off_idx)
+    dropped = on_idx[drop_on]
+    dropped_note = events['note'][dropped].astype(np.int64)
+    pos = np.searchsorted(off_key, dropped_note * n + dropped, side='right')
+    valid = pos < len(off_key)
+    cand = off_key[pos[valid]]
+    match = cand // n == dropped_note[valid]
+    keep[cand[match] % n] = False
+
+    return pack_events(t_ms[keep], events['type'][keep], events['note'][keep], events['vel'][keep]), int(drop_on.sum())
+
+
+def split_voices(events, voices):
+    """
+    Verteilt die Noten auf voices einstimmige Stimmen: ein NOTE_ON geht an die
+    Stimme, die diese Note schon spielt, sonst an die erste freie, sonst an die
+    Stimme mit der ältesten Note (die dann wie beim Abspielen abgelöst wird).
+    Ein NOTE_OFF geht an die Stimme, die die Note zuletzt bekommen hat. Andere
+    Event-Typen entfallen. Mit voices=1 bleibt die klingende Notenfolge gleich.
+
+    Liefert eine Liste von Event-Arrays, eine pro Stimme, jeweils so lang wie
+    das Original (letztes Event bei Bedarf ein Füll-Event).
+    """
+    t_ms = np.cumsum(events['dt'], dtype=np.int64)
+    total_ms = int(t_ms[-1]) if len(t_ms) else 0
+    rows = [[] for _ in range(voices)]
+    sounding = [None] * voices  # Note pro Stimme
+    started = [0] * voices  # Startzeit der Note pro Stimme
+    owner = {}  # Note -> Stimme
+    for t, (_, ev_type, note, vel) in zip(t_ms.tolist(), events.tolist()):
+        if ev_type == NOTE_ON:
+            v = owner.get(note)
+            if v is None:
+                free = [i for i in range(voices) if sounding[i] is None]
+                v = free[0] if free else min(range(voices), key=started.__getitem__)
+            sounding[v] = note
+            started[v] = t
+            owner[note] = v
+            rows[v].append((t, ev_type, note, vel))
+        elif ev_type == NOTE_OFF and note in owner:
+            # Auch für abgelöste Noten weiterleiten: wird die neue Note durch
+            # die Sperrzeit geblockt, beendet dieses NOTE_OFF die alte
+            v = owner.pop(note)
+            if sounding[v] == note:
+                sounding[v] = None
+            rows[v].append((t, ev_type, note, vel))
+
+    result = []
+    for voice_rows in rows:
+        if not voice_rows or voice_rows[-1][0] < total_ms:
+            voice_rows.append((total_ms, 0, 0, 0))
+        t, types, notes, vels = zip(*voice_rows)
+        result.append(pack_events(t, types, notes, vels))
+    return result
+
+
+def merge_voices(parts, t_on_parts=None):
+    """
+    Fügt einstimmige Event-Arrays (z.B. aus split_voices()) zu einer
+    gemeinsamen Zeitleiste zusammen; bei gleicher Zeit kommt die niedrigere
+    Stimme zuerst. t_on_parts enthält pro Stimme None oder t_ON pro Event;
+    fehlende Werte werden 0 (= aktueller Höchstwert des Ausgangs).
+    Liefert (Events, t_ON pro Event oder None, Stimme pro Event als uint8).
+    """
+    t_ms = np.concatenate([np.cumsum(p['dt'], dtype=np.int64) for p in parts])
+    events = np.concatenate(parts)
+    voice = np.concatenate([np.full(len(p), i, dtype=np.uint8) for i, p in enumerate(parts)])
+    order = np.argsort(t_ms, kind='stable')
+    # Jede Stimme überbrückt lange Pausen selbst, die gemeinsame Zeitleiste
+    # braucht daher keine zusätzlichen Füll-Events
+    merged = pack_events(t_ms[order], events['type'][order], events['note'][order], events['vel'][order])
+    t_on = None
+    if t_on_parts is not None and any(t is not None for t in t_on_parts):
+        t_on = np.concatenate([np.zeros(len(p), dtype=np.int64) if t is None else np.asarray(t, dtype=np.int64)
+                               for p, t in zip(parts, t_on_parts)])[order]
+    return merged, t_on, voice[order]
+
+
+def fit_to_budget(events, max_t_on_us, block_time_us, max_duty_percent,
+                  window_ms=ANALYSIS_WINDOW_MS, thin_gap_ms=None, transpose=0):
+    """
+    Schlägt eine Umschreibung des Songs vor, damit jedes Fenster unter
+    MAX_DUTY_CYCLE bleibt: optional schnelle Läufe ausdünnen, danach t_ON pro
+    Note senken. Jede Note bekommt den kleinsten Skalierungsfaktor aller
+    Fenster, die sie überdeckt. Die Duty hängt von der Frequenz ab, also auch
+    von der Transponierung (transpose in Halbtönen, wie MIDI_TRANSPOSE).
+
+    Liefert (Events, t_ON pro Event in µs, Bericht).
+    """
+    thinned = 0
+    if thin_gap_ms:
+        events, thinned = thin_fast_runs(events, thin_gap_ms)
+
+    before = analyze_events(events, max_t_on_us, block_time_us, max_duty_percent, window_ms, transpose)
+    tl = before['timeline']
+    budget = max_duty_percent / 100.0
+    duty = before['duty']
+    scale = np.ones_like(duty)
+    np.divide(budget, duty, out=scale, where=duty > budget)
+
+    # Minimum der Skalierung über alle von einer Note überdeckten Fenster
+    first_w = tl['start_ms'] // window_ms
+    last_w = np.maximum(first_w, (tl['end_ms'] - 1) // window_ms)
+    note_scale = np.ones(len(first_w))
+    if len(first_w):
+        bounds = np.empty(2 * len(first_w), dtype=np.int64)
+        bounds[0::2] = first_w
+        bounds[1::2] = last_w + 1
+        padded = np.append(scale, 1.0)
+        note_scale = np.minimum.reduceat(padded, np.minimum(bounds, len(scale)))[0::2]
+
+    t_on = np.full(len(events), max_t_on_us, dtype=np.int64)
+    t_on[tl['fired_idx']] = np.maximum(MIN_FIT_T_ON, np.floor(max_t_on_us * note_scale)).astype(np.int64)
+
+    after = analyze_events(events, t_on, block_time_us, max_duty_percent, window_ms, transpose)
+    fired_t_on = t_on[tl['fired_idx']]
+    report = {
+        'thinned_notes': thinned,
+        'lowered_notes': int(np.count_nonzero(fired_t_on < max_t_on_us)),
+        'min_t_on_us': int(fired_t_on.min()) if len(fired_t_on) else max_t_on_us,
+        'mean_t_on_us': float(fired_t_on.mean()) if len(fired_t_on) else float(max_t_on_us),
+        'max_duty_percent_before': before['summary']['max_duty_percent'],
+        'max_duty_percent_after': after['summary']['max_duty_percent'],
+        'fits_budget': after['summary']['fits_budget'],
+    }
+    return events, t_on, report
+
+
+def optimize_events(events, block_time_us, t_on_us=None):
+    """
+    Entfernt Events, die beim Abspielen keine oder eine überflüssige
+    Hardware-Änderung auslösen:
+    - NOTE_ONs, die durch NOTE_BLOCK_TIME_US ohnehin geblockt würden
+    - NOTE_OFFs für Noten, die gerade nicht klingen
+    - NOTE_OFF direkt (dt = 0) vor der nächsten Note; bei derselben Note mit
+      gleicher t_ON entfällt auch das erneute NOTE_ON (Retrigger)
+    - alle anderen Event-Typen (z.B. Pitch Bend), die der Player ignoriert
+
+    Die klingende Notenfolge bleibt dieselbe. Liefert (Events, t_ON pro Event
+    oder None, Bericht mit Event- und pigpio-Aufrufzahlen vorher/nachher).
+    """
+    t_on_arg = MIN_FIT_T_ON if t_on_us is None else t_on_us
+    tl = note_timeline(events, t_on_arg, block_time_us)
+    fired_idx = tl['fired_idx']
+    n_fired = len(fired_idx)
+
+    # Übergabe ohne Pause: Segment endet per NOTE_OFF genau dort, wo das
+    # nächste beginnt -> das NOTE_OFF ist überflüssig.
+    handover = np.zeros(n_fired, dtype=bool)
+    handover[:-1] = tl['end_by_off'][:-1] & (tl['end_ms'][:-1] == tl['start_ms'][1:])
+    retrigger = np.zeros(n_fired, dtype=bool)
+    retrigger[1:] = handover[:-1] & (tl['note'][1:] == tl['note'][:-1]) & (tl['t_on_us'][1:] == tl['t_on_us'][:-1])
+
+    keep_on = fired_idx[~retrigger]
+    keep_off = tl['end_idx'][tl['end_by_off'] & ~handover]
+    keep = np.sort(np.concatenate([keep_on, keep_off]))
+    # Klingt die letzte Note bis zum Song-Ende, muss das letzte Event erhalten
+    # bleiben, sonst würde sie früher abgeschaltet.
+    if n_fired and not tl['end_by_off'][-1] and (not len(keep) or keep[-1] != len(events) - 1):
+        keep = np.append(keep, len(events) - 1)
+        events = events.copy()
+        events['type'][-1] = 0
+
+    t_ms = tl['t_ms']
+    optimized = pack_events(t_ms[keep], events['type'][keep], events['note'][keep], events['vel'][keep])
+    new_t_on = None
+    if t_on_us is not None:
+        # Position jedes behaltenen Events hinter den von pack_events() eingefügten Füll-Events
+        dt = np.diff(t_ms[keep], prepend=0)
+        pos = np.arange(len(keep)) + np.cumsum(np.maximum((dt - 1) // MAX_DT_MS, 0))
+        new_t_on = np.full(len(optimized), MIN_FIT_T_ON, dtype=np.int64)
+        new_t_on[pos] = np.asarray(t_on_us)[keep]
+
+    n_blocked = int(tl['blocked'].sum())
+    n_off = int(np.count_nonzero(events['type'] == NOTE_OFF))
+    calls_before = n_fired + int(tl['end_by_off'].sum()) + 1
+    calls_after = len(keep_on) + len(keep_off) + 1
+    report = {
+        'events_before': int(len(events)),
+        'events_after': int(len(optimized)),
+        'blocked_notes_removed': n_blocked,
+        'stray_note_offs_removed': n_off - int(tl['end_by_off'].sum()),
+        'handovers_merged': int(handover.sum()),
+        'retriggers_merged': int(retrigger.sum()),
+        'other_events_removed': int(np.count_nonzero((events['type'] != NOTE_ON) & (events['type'] != NOTE_OFF))),
+        'pigpio_calls_before': calls_before,
+        'pigpio_calls_after': calls_after,
+    }
+    return optimized, new_t_on, report
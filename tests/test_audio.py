@@ -0,0 +1,36 @@
+"""
+Hörprobe (audio.py) für Songs und Stimmen ohne gespielte Note.
+"""
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import audio  # noqa: E402
+import songs  # noqa: E402
+
+MIDI_FILES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'midi-files')
+T_ON_US = 100
+BLOCK_TIME_US = 1000
+
+
+def _render(voices):
+    chunks = list(audio.render_wav(voices))
+    header, data = chunks[0], b''.join(chunks[1:])
+    assert struct.unpack_from('<I', header, 40)[0] == len(data)
+    return data
+
+
+def test_song_without_notes():
+    events = songs.pack_events([0, 500, 1000], [songs.NOTE_OFF, 0xE0, songs.NOTE_OFF], [60, 0, 60], [0, 0, 0])
+    data = _render([(events, T_ON_US, BLOCK_TIME_US)])
+    assert len(data) > 0 and not any(data)
+
+
+def test_dual_output_monophonic_song():
+    events = songs.load_events(os.path.join(MIDI_FILES_DIR, 'AmazingGraceBagpipes'))
+    parts = songs.split_voices(events, 2)
+    assert not (parts[1]['type'] == songs.NOTE_ON).any()
+    data = _render([(part, T_ON_US, BLOCK_TIME_US) for part in parts])
+    assert any(data)
@@ -0,0 +1,97 @@
+"""
+Differenztest für songs.optimize_events(): Original und optimierte Events
+laufen durch eine Nachbildung der ursprünglichen Player-Schleife aus
+main.play_midi_file() (einstimmig, Sperrzeit ab dem letzten gefeuerten
+NOTE_ON, NOTE_OFF nur für die klingende Note). Verglichen wird der
+Ausgang über die Zeit, also was nach allen Aufrufen eines Zeitpunkts an
+hardware_PWM() anliegt.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import songs  # noqa: E402
+
+MIDI_FILES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'midi-files')
+SONGS = sorted(os.listdir(MIDI_FILES_DIR)) if os.path.isdir(MIDI_FILES_DIR) else []
+T_ON_US = 100
+BLOCK_TIME_US = 1000
+MAX_DUTY_PERCENT = 1
+
+
+def _pwm(note, t_on_us):
+    # Wie main.midi_note_to_frequency() und calculate_max_duty_cycle()
+    freq = 440.0 * 2.0 ** ((note - 69) / 12.0)
+    duty = min(int(t_on_us / 1_000_000.0 * freq * 1_000_000), 1_000_000)
+    return int(freq), duty
+
+
+def reference_output(events, t_on_us=None):
+    """
+    Liste (Zeit in ms, (Frequenz, Duty)) der Zustandswechsel am Ausgang,
+    bei idealem Timing. Endet mit dem Abschalten nach dem letzten Event.
+    """
+    calls = []
+    t_ms = 0
+    last_trigger_ms = None
+    active_note = None
+    for i, ev in enumerate(events.tolist()):
+        dt, ev_type, note, _ = ev
+        t_ms += dt
+        if ev_type == songs.NOTE_ON:
+            if last_trigger_ms is not None and (t_ms - last_trigger_ms) * 1000 < BLOCK_TIME_US:
+                continue
+            active_note = note
+            calls.append((t_ms, _pwm(note, T_ON_US if t_on_us is None else int(t_on_us[i]))))
+            last_trigger_ms = t_ms
+        elif ev_type == songs.NOTE_OFF and note == active_note:
+            calls.append((t_ms, (0, 0)))
+            active_note = None
+    calls.append((t_ms, (0, 0)))
+
+    # Pro Zeitpunkt zählt nur der letzte Aufruf, unveränderte Zustände entfallen
+    output = []
+    for t, state in calls:
+        if output and output[-1][0] == t:
+            output.pop()
+        if not output or output[-1][1] != state:
+            output.append((t, state))
+    return output
+
+
+@pytest.mark.parametrize('name', SONGS)
+def test_optimize_keeps_output(name):
+    events = songs.load_events(os.path.join(MIDI_FILES_DIR, name))
+    optimized, t_on, report = songs.optimize_events(events, BLOCK_TIME_US)
+    assert t_on is None
+    assert reference_output(optimized) == reference_output(events)
+    assert report['pigpio_calls_after'] <= report['pigpio_calls_before']
+
+
+@pytest.mark.parametrize('name', SONGS)
+def test_optimize_keeps_fitted_output(name):
+    events = songs.load_events(os.path.join(MIDI_FILES_DIR, name))
+    fitted, t_on, _ = songs.fit_to_budget(events, T_ON_US, BLOCK_TIME_US, MAX_DUTY_PERCENT)
+    optimized, new_t_on, _ = songs.optimize_events(fitted, BLOCK_TIME_US, t_on)
+    assert reference_output(optimized, new_t_on) == reference_output(fitted, t_on)
+
+
+def test_first_note_is_kept():
+    events = songs.pack_events([0, 10, 20, 30], [songs.NOTE_ON, songs.NOTE_OFF, songs.NOTE_ON, songs.NOTE_OFF],
+                               [60, 60, 62, 62], [100] * 4)
+    optimized, _, _ = songs.optimize_events(events, BLOCK_TIME_US)
+    assert optimized['type'][0] == songs.NOTE_ON and optimized['note'][0] == 60
+    assert reference_output(optimized)[0] == (0, _pwm(60, T_ON_US))
+
+
+def test_fillers_with_per_event_t_on():
+    # Letzte Note klingt bis zum Song-Ende, letztes Event ist kein Noten-Event, Lücke > MAX_DT_MS
+    events = songs.pack_events([0, 10, 100_000], [songs.NOTE_ON, songs.NOTE_ON, 0xE0], [60, 62, 0], [100, 100, 0])
+    t_on = np.array([50, 60, 0, 70], dtype=np.int64)
+    optimized, new_t_on, _ = songs.optimize_events(events, BLOCK_TIME_US, t_on)
+    assert len(new_t_on) == len(optimized)
+    assert reference_output(optimized, new_t_on) == reference_output(events, t_on)
@@ -0,0 +1,52 @@
+"""
+Gemeinsame Hilfen für die Benchmarks: main.py als eigenen Prozess starten
+und einfache HTTP-Aufrufe ohne zusätzliche Abhängigkeiten.
+"""
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def request(port, path, data=None, timeout=5.0):
+    """
+    GET (data=None) oder POST (Formulardaten) an den lokalen Server, liefert das JSON.
+    """
+    url = f"http://127.0.0.1:{port}{path}"
+    body = urllib.parse.urlencode(data).encode() if data is not None else None
+    with urllib.request.urlopen(url, data=body, timeout=timeout) as resp:
+        return json.loads(resp.read() or b'null')
+
+
+@contextlib.contextmanager
+def server(port, backend='sim', timeout_s=10.0, **env):
+    """
+    Startet main.py mit dem gegebenen Backend und zusätzlichen Umgebungsvariablen
+    und wartet, bis /playback_status antwortet; mit Engine-Prozess auch, bis die
+    Engine sich gemeldet hat (vorher lehnt /play_midi mit 503 ab).
+    """
+    full_env = dict(os.environ, INTERRUPTER_BACKEND=backend, INTERRUPTER_PORT=str(port), **env)
+    proc = subprocess.Popen([sys.executable, 'main.py'], cwd=ROOT, env=full_env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.perf_counter() + timeout_s
+        while True:
+            try:
+                status = request(port, '/playback_status', timeout=0.5)
+                if env.get('INTERRUPTER_ENGINE') != 'process' or status.get('engine_pid'):
+                    break
+            except OSError:
+                pass
+            if time.perf_counter() > deadline or proc.poll() is not None:
+                raise RuntimeError("Server startet nicht")
+            time.sleep(0.01)
+        yield proc
+    finally:
+        proc.terminate()
+        proc.wait()
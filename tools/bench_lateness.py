@@ -0,0 +1,67 @@
+"""
+Vergleicht die Verspätung der Wiedergabe-Events mit und ohne Echtzeit-Modus
+(INTERRUPTER_REALTIME=1) unter gleichzeitiger HTTP-Last.
+
+    python tools/bench_lateness.py --song Tetris --seconds 10 --clients 8
+    python tools/bench_lateness.py --engine process   # Engine im eigenen Prozess
+"""
+import argparse
+import threading
+import time
+
+from _server import request, server
+
+
+def _load(port, stop):
+    paths = ['/playback_status', '/get_midi_files', '/analyze_midi?midi_file=AxelF&thin=1']
+    i = 0
+    while not stop.is_set():
+        try:
+            request(port, paths[i % len(paths)])
+        except OSError:
+            pass
+        i += 1
+
+
+def _buckets(status):
+    bounds = [f"<={b}" for b in status['lateness_bucket_bounds_us']] + ['>']
+    return ", ".join(f"{b}: {n}" for b, n in zip(bounds, status['lateness_buckets']))
+
+
+def run(port, realtime, song, seconds, clients, engine='thread'):
+    env = {'INTERRUPTER_REALTIME': '1' if realtime else '0', 'INTERRUPTER_ENGINE': engine}
+    with server(port, **env):
+        request(port, '/play_midi', {'midi_file': song})
+        stop = threading.Event()
+        threads = [threading.Thread(target=_load, args=(port, stop)) for _ in range(clients)]
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        status = request(port, '/playback_status')
+        request(port, '/stop_midi', {})
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--song', default='Tetris')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--port', type=int, default=5058)
+    parser.add_argument('--engine', default='thread', choices=['thread', 'process'])
+    args = parser.parse_args()
+
+    for realtime in (False, True):
+        s = run(args.port, realtime, args.song, args.seconds, args.clients, args.engine)
+        print(f"Echtzeit {'an ' if realtime else 'aus'}: {s['events']} Events, "
+              f"Verspätung Mittel {s['lateness_mean_us']:.0f} µs, max {s['lateness_max_us']:.0f} µs, "
+              f"Verteilung {_buckets(s)}")
+        if realtime:
+            print(f"  Einstellungen: {s['realtime']}")
+
+
+if __name__ == '__main__':
+    main()
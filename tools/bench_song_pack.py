@@ -0,0 +1,89 @@
+"""
+Vergleich Song-Pack gegen einzelne Dateien: Dauer für die Auflistung der
+Bibliothek und bis zur ersten Note eines Songs (Öffnen, Lesen, erstes NOTE_ON).
+
+Die Auflistung öffnet das Pack jedes Mal neu (wie beim Serverstart), für die
+erste Note ist es wie im Betrieb schon geöffnet; die Prüfsumme des Songs wird
+in jedem Durchlauf neu geprüft (wie beim ersten Abspielen). Mit --drop-caches (nur als
+root) wird vor jedem Durchlauf der Page Cache geleert, das entspricht dem
+ersten Zugriff nach dem Booten von der SD-Karte.
+
+    python tools/build_song_pack.py && python tools/bench_song_pack.py --runs 50
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+import songpack  # noqa: E402
+import songs  # noqa: E402
+
+
+def drop_caches():
+    os.sync()
+    with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3\n')
+
+
+def list_loose(source):
+    return [f for f in os.listdir(source) if os.path.isfile(os.path.join(source, f))]
+
+
+def list_pack(path, source):
+    return songpack.SongPack(path, source).names()
+
+
+def first_note_loose(source, song):
+    events = songs.load_events(os.path.join(source, song))
+    return int(np.argmax(events['type'] == songs.NOTE_ON))
+
+
+def first_note_pack(pack, song):
+    pack._verified.discard(song)
+    events = pack.events(song)
+    return int(np.argmax(events['type'] == songs.NOTE_ON))
+
+
+def measure(func, runs, cold):
+    times = []
+    for _ in range(runs):
+        if cold:
+            drop_caches()
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(times), max(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Song-Pack gegen einzelne Dateien")
+    parser.add_argument('--source', default=os.path.join(ROOT, 'data', 'midi-files'))
+    parser.add_argument('--pack', default=os.path.join(ROOT, 'data', 'songs.pack'))
+    parser.add_argument('--song', default='Tetris')
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--drop-caches', action='store_true')
+    args = parser.parse_args()
+    if not os.path.exists(args.pack):
+        sys.exit(f"{args.pack} fehlt, zuerst tools/build_song_pack.py ausführen")
+
+    pack = songpack.SongPack(args.pack, args.source)
+    cases = [
+        ('Auflistung, Dateien', lambda: list_loose(args.source)),
+        ('Auflistung, Pack', lambda: list_pack(args.pack, args.source)),
+        ('Erste Note, Datei', lambda: first_note_loose(args.source, args.song)),
+        ('Erste Note, Pack', lambda: first_note_pack(pack, args.song)),
+    ]
+    print(f"{'':24} {'Median µs':>10} {'Max µs':>10}")
+    for name, func in cases:
+        median, worst = measure(func, args.runs, args.drop_caches)
+        print(f"{name:24} {median:10.1f} {worst:10.1f}")
+
+
+if __name__ == '__main__':
+    main()
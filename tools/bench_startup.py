@@ -0,0 +1,55 @@
+"""
+Startzeit-Benchmark: Zeit vom Prozessstart bis zur ersten beantworteten Anfrage.
+
+Startet main.py wiederholt als eigenen Prozess (standardmäßig mit dem
+simulierten Backend) und fragt /playback_status ab, bis eine Antwort kommt.
+
+    python tools/bench_startup.py --runs 10
+    python tools/bench_startup.py --backend pigpio   # auf dem Pi
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_once(backend, port, timeout_s=10.0):
+    env = dict(os.environ, INTERRUPTER_BACKEND=backend, INTERRUPTER_PORT=str(port))
+    url = f"http://127.0.0.1:{port}/playback_status"
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, 'main.py'], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout_s:
+            try:
+                with urllib.request.urlopen(url, timeout=0.5) as resp:
+                    resp.read()
+                    return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError(f"Keine Antwort nach {timeout_s} s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--backend', default='sim')
+    parser.add_argument('--port', type=int, default=5057)
+    args = parser.parse_args()
+
+    times = [measure_once(args.backend, args.port) for _ in range(args.runs)]
+    print(f"Kaltstart bis erste Antwort ({args.backend}, {args.runs} Läufe): "
+          f"Median {statistics.median(times) * 1000:.0f} ms, "
+          f"min {min(times) * 1000:.0f} ms, max {max(times) * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+"""
+Baut das Song-Pack (eine Datei mit allen Songs, siehe songpack.py) aus dem
+MIDI-Ordner neu. Nach jeder Änderung an der Bibliothek erneut ausführen.
+
+    python tools/build_song_pack.py
+    python tools/build_song_pack.py --source data/midi-files --out data/songs.pack
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import songpack  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--source', default=os.path.join(ROOT, 'data', 'midi-files'))
+    parser.add_argument('--out', default=os.path.join(ROOT, 'data', 'songs.pack'))
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = songpack.build(args.source, args.out)
+    pack = songpack.SongPack(args.out)
+    for name in pack.names():
+        pack.data(name)  # Prüfsummen einmal gegenlesen
+    print(f"{count} Songs, {os.path.getsize(args.out)} Bytes -> {args.out} "
+          f"({(time.perf_counter() - start) * 1000:.1f} ms)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Flottenbetrieb lokal ausprobieren: ein Leader und mehrere Follower als
+eigene Prozesse mit simuliertem Backend. Jeder Knoten bekommt einen
+künstlichen Uhrversatz, der Uhrabgleich muss ihn herausrechnen.
+
+Gemessen wird pro Runde der Versatz zwischen den Knoten: tatsächlicher
+Zeitpunkt einer Note minus deren Abstand zum Songbeginn, einmal für die
+erste und einmal für die zuletzt gespielte Note (zeigt, ob Verspätungen
+während des Songs auseinanderlaufen). Da alle Prozesse auf derselben
+Maschine laufen, sind die Zeitstempel direkt vergleichbar. Ziel: unter 1 ms.
+
+    python tools/fleet_demo.py --followers 2 --rounds 5
+    python tools/fleet_demo.py --song PreludeNo1 --play-s 3
+    python tools/fleet_demo.py --realtime   # SCHED_FIFO, braucht CAP_SYS_NICE
+"""
+import argparse
+import contextlib
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _server import request, server  # noqa: E402
+
+SIM_OFFSETS_MS = (0.0, 37.5, -120.25, 950.0, -3.3)
+
+
+def wait_for_followers(port, count, timeout_s=15.0):
+    deadline = time.perf_counter() + timeout_s
+    while time.perf_counter() < deadline:
+        if len(request(port, '/fleet/status')['followers']) >= count:
+            return
+        time.sleep(0.1)
+    raise RuntimeError("Follower melden sich nicht beim Leader")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flotten-Synchronität mit lokalen Prozessen")
+    parser.add_argument('--followers', type=int, default=2)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--song', default='HearthOfCourage', help="alle Stimmen sollten früh einsetzen")
+    parser.add_argument('--play-s', type=float, default=2.0, help="Wiedergabedauer pro Runde")
+    parser.add_argument('--port', type=int, default=5700)
+    parser.add_argument('--fleet-port', type=int, default=5705)
+    parser.add_argument('--realtime', action='store_true')
+    args = parser.parse_args()
+
+    env = {'INTERRUPTER_METRICS': '0'}
+    if args.realtime:
+        env['INTERRUPTER_REALTIME'] = '1'
+    ports = [args.port + i for i in range(args.followers + 1)]
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(server(ports[0], INTERRUPTER_FLEET='leader', INTERRUPTER_FLEET_PORT=str(args.fleet_port),
+                                   INTERRUPTER_FLEET_SIM_OFFSET_MS=str(SIM_OFFSETS_MS[0]), **env))
+        for i, port in enumerate(ports[1:], 1):
+            stack.enter_context(server(port, INTERRUPTER_FLEET='follower',
+                                       INTERRUPTER_FLEET_LEADER=f"127.0.0.1:{args.fleet_port}",
+                                       INTERRUPTER_FLEET_SIM_OFFSET_MS=str(SIM_OFFSETS_MS[i % len(SIM_OFFSETS_MS)]),
+                                       **env))
+        wait_for_followers(ports[0], args.followers)
+
+        for port in ports[1:]:
+            s = request(port, '/fleet/status')
+            true_offset_ms = SIM_OFFSETS_MS[0] - SIM_OFFSETS_MS[ports.index(port) % len(SIM_OFFSETS_MS)]
+            print(f"Follower :{port} Stimme {s['voice']}: Offset {s['offset_ns'] / 1e6:+.4f} ms "
+                  f"(wahr {true_offset_ms:+.4f} ms), Laufzeit {s['delay_ns'] / 1e3:.1f} µs")
+
+        skews = []
+        for r in range(args.rounds):
+            result = request(ports[0], '/fleet/play', {'midi_file': args.song})
+            if result['status'] != 'success' or any(f['status'] != 'success' for f in result['followers']):
+                raise RuntimeError(f"Start fehlgeschlagen: {result}")
+            time.sleep(0.5 + args.play_s)
+            starts = {'erste': [], 'letzte': []}
+            for port in ports:
+                s = request(port, '/fleet/status')
+                request(port, '/stop_midi', {})
+                if s['first_note_late_us'] is None:
+                    raise RuntimeError(f"Knoten :{port} hat keine Note gespielt")
+                starts['erste'].append(s['start_ns'] + s['first_note_late_us'] * 1000)
+                starts['letzte'].append(s['start_ns'] + s['last_note_late_us'] * 1000)
+            for which, values in starts.items():
+                skew_us = (max(values) - min(values)) / 1000
+                skews.append(skew_us)
+                print(f"Runde {r + 1}, {which:6s} Note: Versatz {skew_us:8.1f} µs  "
+                      f"({', '.join(f'{(t - values[0]) / 1000:+.1f}' for t in values)} µs relativ zum Leader)")
+            time.sleep(0.3)
+        print(f"Median {statistics.median(skews):.1f} µs, max {max(skews):.1f} µs "
+              f"-> {'OK' if max(skews) < 1000 else 'über 1 ms'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Lasttest der Steuer-Endpunkte während einer Wiedergabe: mehrere Clients
+(wie mehrere Handys mit offener Oberfläche) schieben gleichzeitig Regler
+(/set_ton_toff, /set_duty_cycle, /set_burst), fragen den Status ab und
+feuern Single Shots, während ein Song läuft. Läuft gegen den simulierten
+Backend-Server.
+
+Pro Durchlauf zwei Phasen auf demselben Server: erst spielt der Song ohne
+Last ('ruhig'), dann wird er neu gestartet und die Clients laufen ('Last').
+Ausgegeben werden Latenz-Perzentile und Durchsatz pro Anfrage-Art sowie die
+Verspätung der Wiedergabe-Events in beiden Phasen.
+
+Mit --save landet das Ergebnis unter dem Namen des Betriebsmodus in
+BASELINE_PATH, mit --compare wird gegen den dort gespeicherten Stand verglichen:
+
+    python tools/load_test.py --save                       # Thread-Engine
+    python tools/load_test.py --engine process --save      # Engine-Prozess
+    python tools/load_test.py --engine process --realtime --compare
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+
+from _server import request, server
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'load_baseline.json')
+PERCENTILES = (50, 95, 99)
+
+# (Art, Gewicht, Funktion(rng) -> (Pfad, Formulardaten oder None)), Werte innerhalb der Grenzen aus main.py
+MIX = (
+    ('slider', 4, lambda rng: rng.choice((
+        ('/set_ton_toff', {'t_on': rng.randint(10, 150), 't_off': rng.randint(10, 100)}),
+        ('/set_duty_cycle', {'duty_cycle': round(rng.uniform(0.1, 1.0), 2), 'frequency': rng.randint(50, 100)}),
+        ('/set_burst', {'bps': rng.randint(1, 50), 't_on': rng.randint(10, 150)}),
+    ))),
+    ('status', 4, lambda rng: (rng.choice(('/playback_status', '/burst_status', '/softstart_status')), None)),
+    ('single_shot', 1, lambda rng: ('/single_shot', {'t_on': rng.randint(10, 100)})),
+)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def _client(port, seed, stop, interval_s, samples, errors):
+    rng = random.Random(seed)
+    kinds = [kind for kind, weight, _ in MIX for _ in range(weight)]
+    build = {kind: func for kind, _, func in MIX}
+    while not stop.is_set():
+        kind = rng.choice(kinds)
+        path, data = build[kind](rng)
+        start = time.perf_counter()
+        try:
+            request(port, path, data)
+            samples[kind].append(time.perf_counter() - start)
+        except OSError:
+            errors[kind] += 1
+        if interval_s:
+            time.sleep(interval_s)
+
+
+def _lateness(status):
+    return {'events': status['events'], 'mean_us': round(status['lateness_mean_us'], 1),
+            'max_us': round(status['lateness_max_us'], 1),
+            'buckets': dict(zip([f"<={b}" for b in status['lateness_bucket_bounds_us']] + ['>'],
+                                status['lateness_buckets']))}
+
+
+def _restart(port, song):
+    request(port, '/stop_midi', {})
+    time.sleep(0.2)  # Wiedergabe-Thread bzw. Engine beendet den alten Song
+    request(port, '/play_midi', {'midi_file': song})
+
+
+def run(port, song, seconds, clients, interval_ms, seed, **env):
+    """
+    Beide Phasen auf einem Server. Liefert das Ergebnis als dict (JSON-fähig).
+    """
+    with server(port, **env):
+        _restart(port, song)
+        time.sleep(seconds)
+        quiet = _lateness(request(port, '/playback_status'))
+
+        stop = threading.Event()
+        samples = {kind: [] for kind, _, _ in MIX}
+        errors = {kind: 0 for kind, _, _ in MIX}
+        _restart(port, song)
+        threads = [threading.Thread(target=_client, args=(port, seed + i, stop, interval_ms / 1000, samples, errors))
+                   for i in range(clients)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        loaded = _lateness(request(port, '/playback_status'))
+        request(port, '/stop_midi', {})
+
+    requests = {}
+    for kind, values in samples.items():
+        values.sort()
+        requests[kind] = {'count': len(values), 'errors': errors[kind], 'per_s': round(len(values) / elapsed, 1),
+                          **{f"p{p}_ms": round(percentile(values, p) * 1000, 2) for p in PERCENTILES},
+                          'max_ms': round(values[-1] * 1000, 2) if values else 0.0}
+    total = sum(len(v) for v in samples.values())
+    return {'song': song, 'seconds': seconds, 'clients': clients, 'interval_ms': interval_ms,
+            'throughput_per_s': round(total / elapsed, 1), 'requests': requests,
+            'lateness_quiet': quiet, 'lateness_loaded': loaded,
+            'lateness_mean_increase_us': round(loaded['mean_us'] - quiet['mean_us'], 1),
+            'lateness_max_increase_us': round(loaded['max_us'] - quiet['max_us'], 1)}
+
+
+def report(result, baseline=None):
+    def delta(new, old):
+        return f" ({new - old:+.2f})" if old is not None else ""
+
+    old_requests = (baseline or {}).get('requests', {})
+    print(f"{result['clients']} Clients, {result['seconds']} s: "
+          f"{result['throughput_per_s']} Anfragen/s{delta(result['throughput_per_s'], (baseline or {}).get('throughput_per_s'))}")
+    for kind, r in result['requests'].items():
+        old = old_requests.get(kind, {})
+        print(f"  {kind:12s} {r['count']:6d} ({r['per_s']}/s, {r['errors']} Fehler)  "
+              + "  ".join(f"p{p} {r[f'p{p}_ms']:.2f} ms{delta(r[f'p{p}_ms'], old.get(f'p{p}_ms'))}"
+                          for p in PERCENTILES)
+              + f"  max {r['max_ms']:.2f} ms")
+    for phase in ('quiet', 'loaded'):
+        s = result[f'lateness_{phase}']
+        old = (baseline or {}).get(f'lateness_{phase}', {})
+        print(f"  Verspätung {'ruhig' if phase == 'quiet' else 'Last '}: {s['events']} Events, "
+              f"Mittel {s['mean_us']:.0f} µs{delta(s['mean_us'], old.get('mean_us'))}, "
+              f"max {s['max_us']:.0f} µs{delta(s['max_us'], old.get('max_us'))}, {s['buckets']}")
+    print(f"  Zunahme durch Last: Mittel {result['lateness_mean_increase_us']:+.0f} µs, "
+          f"max {result['lateness_max_increase_us']:+.0f} µs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--song', default='Badinerie')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--interval-ms', type=float, default=0, help='Pause pro Client zwischen Anfragen')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--port', type=int, default=5059)
+    parser.add_argument('--engine', default='thread', choices=['thread', 'process'])
+    parser.add_argument('--realtime', action='store_true')
+    parser.add_argument('--mode', help='Name des Betriebsmodus in der Baseline (Standard aus --engine/--realtime)')
+    parser.add_argument('--save', action='store_true', help=f'Ergebnis in {os.path.basename(BASELINE_PATH)} ablegen')
+    parser.add_argument('--compare', action='store_true', help='gegen die gespeicherte Baseline vergleichen')
+    args = parser.parse_args()
+
+    mode = args.mode or f"{args.engine}{'-realtime' if args.realtime else ''}"
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baselines = json.load(f)
+    result = run(args.port, args.song, args.seconds, args.clients, args.interval_ms, args.seed,
+                 INTERRUPTER_ENGINE=args.engine, INTERRUPTER_REALTIME='1' if args.realtime else '0')
+    print(f"Modus {mode}")
+    report(result, baselines.get(mode) if args.compare else None)
+    if args.save:
+        baselines[mode] = result
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baselines, f, indent=2)
+            f.write('\n')
+        print(f"Baseline für {mode} gespeichert: {BASELINE_PATH}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Profiling-Aufzeichnung einer Wiedergabe als Chrome-/Perfetto-Trace (JSON).
+
+Aufgezeichnet werden Spans (Start, Dauer, Thread) in vorab angelegte Listen;
+solange keine Aufzeichnung läuft, kostet ein Aufruf nur die Abfrage von
+TRACER.active. Quellen: Wiedergabe-Events, pigpio-Befehle
+(metrics.InstrumentedPi), GC-Pausen (gc.callbacks) und jede
+TRACE_REQUEST_SAMPLE-te Flask-Anfrage. Zeitbasis ist time.perf_counter_ns()
+(CLOCK_MONOTONIC), damit lassen sich Spans mehrerer Prozesse zusammenführen.
+"""
+import gc
+import json
+import os
+import threading
+import time
+
+from recorder import BufferedRecorder
+
+DEFAULT_CAPACITY = 200_000
+
+
+class TraceRecorder(BufferedRecorder):
+    DEFAULT_CAPACITY = DEFAULT_CAPACITY
+    COLUMNS = {'name': None, 'cat': None, 'start': 0, 'end': 0, 'tid': 0, 'args': None}
+
+    def __init__(self):
+        super().__init__()
+        self._gc_start = None
+        self._started_ns = 0
+        self._stopped_ns = 0
+
+    def start(self, capacity=None):
+        super().start(capacity)
+        self._started_ns = time.perf_counter_ns()
+        if self._gc_callback not in gc.callbacks:
+            gc.callbacks.append(self._gc_callback)
+
+    def stop(self):
+        super().stop()
+        self._stopped_ns = time.perf_counter_ns()
+        if self._gc_callback in gc.callbacks:
+            gc.callbacks.remove(self._gc_callback)
+
+    def complete(self, name, cat, start_ns, end_ns, args=None):
+        """
+        Zeichnet einen Span auf. args ist ein dict oder ein Tupel von
+        Befehlsargumenten. Ist der Puffer voll, wird nur gezählt.
+        """
+        i = self._claim()
+        if i is None:
+            return
+        self._name[i] = name
+        self._cat[i] = cat
+        self._start[i] = start_ns
+        self._end[i] = end_ns
+        self._tid[i] = threading.get_ident()
+        self._args[i] = args
+
+    def _gc_callback(self, phase, info):
+        if phase == 'start':
+            self._gc_start = time.perf_counter_ns()
+        elif self._gc_start is not None and self.active:
+            self.complete('gc', 'gc', self._gc_start, time.perf_counter_ns(),
+                          {'generation': info['generation'], 'collected': info['collected']})
+            self._gc_start = None
+
+    def events(self, pid=None, process_name=None):
+        """
+        Liefert die Aufzeichnung als Liste von Chrome-Trace-Events (ts/dur in µs).
+        """
+        pid = pid or os.getpid()
+        count = self.count
+        names = {t.ident: t.name for t in threading.enumerate()}
+        out = []
+        if process_name:
+            out.append({'ph': 'M', 'name': 'process_name', 'pid': pid, 'args': {'name': process_name}})
+        for tid in set(self._tid[:count]):
+            out.append({'ph': 'M', 'name': 'thread_name', 'pid': pid, 'tid': tid,
+                        'args': {'name': names.get(tid, str(tid))}})
+        for i in range(count):
+            event = {'ph': 'X', 'name': self._name[i], 'cat': self._cat[i], 'pid': pid, 'tid': self._tid[i],
+                     'ts': self._start[i] / 1000, 'dur': (self._end[i] - self._start[i]) / 1000}
+            args = self._args[i]
+            if isinstance(args, tuple):
+                # Befehlsargumente (pigpio), nicht-numerische Werte als Text
+                args = {'args': [a if isinstance(a, (int, float)) else str(a) for a in args]}
+            if args is not None:
+                event['args'] = args
+            out.append(event)
+        return out
+
+    def summary(self):
+        return {'active': self.active, **super().summary()}
+
+
+def chrome_trace(events, metadata=None):
+    """
+    Baut das JSON-Objekt für chrome://tracing bzw. ui.perfetto.dev.
+    """
+    return {'traceEvents': events, 'displayTimeUnit': 'ns', 'otherData': metadata or {}}
+
+
+def dump_events(recorder, path, process_name):
+    """
+    Schreibt die Events atomar als JSON-Liste (für den Engine-Prozess).
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(recorder.events(process_name=process_name), f)
+    os.replace(tmp, path)
+
+
+TRACER = TraceRecorder()